@@ -0,0 +1,28 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from merchant_store import MERCHANT_DB, MerchantStore  # noqa: E402
+from spatial import assign_admin_regions  # noqa: E402
+from tiles import EXPORT_DIR, export_merchants  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export the local merchant store as Parquet, GeoJSON and zoom-levelled MBTiles."
+    )
+    parser.add_argument("--db", default=MERCHANT_DB, help="SQLite database path")
+    parser.add_argument("--out", default=EXPORT_DIR, help="Directory the export folder is written to")
+    parser.add_argument("--name", default="world", help="Export name (folder is a slug of it)")
+    args = parser.parse_args()
+
+    store = MerchantStore(args.db)
+    merchants = assign_admin_regions(store.query_bbox(-90, -180, 90, 180))
+    target = export_merchants(merchants, args.name, args.out)
+    print(f"Exported {len(merchants)} merchants to {target}.")
+
+
+if __name__ == "__main__":
+    main()
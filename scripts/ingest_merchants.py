@@ -0,0 +1,32 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from merchant_store import MERCHANT_DB, MerchantStore, ingest_world, refresh_world  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pull Bitcoin-accepting merchants worldwide into the local store.")
+    parser.add_argument("--db", default=MERCHANT_DB, help="SQLite database path")
+    parser.add_argument(
+        "--no-legacy",
+        action="store_true",
+        help="Skip the legacy payment:bitcoin tag",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Re-download every tile instead of applying the changes since the last run",
+    )
+    args = parser.parse_args()
+
+    store = MerchantStore(args.db)
+    ingest = ingest_world if args.full else refresh_world
+    stored, removed = ingest(store, include_legacy=not args.no_legacy)
+    print(f"Stored {stored} merchants, removed {removed} no longer tagged.")
+
+
+if __name__ == "__main__":
+    main()
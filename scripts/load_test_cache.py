@@ -0,0 +1,110 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from cache import BudgetCache, budget_cached, fetch_flights  # noqa: E402
+
+
+class Upstream(BaseHTTPRequestHandler):
+    # Local stand-in for blockchain.info / Overpass: slow enough that every caller of a herd arrives
+    # while the first request is still in flight. Paths under /fail answer 502.
+    delay = 0.5
+    hits = []
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            self.hits.append(self.path)
+        time.sleep(self.delay)
+        if self.path.startswith("/fail"):
+            self.send_response(502)
+            self.end_headers()
+            return
+        body = json.dumps({"path": self.path, "values": list(range(100))}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def herd(fetch, paths, callers):
+    # Releases all callers at once, each asking for paths[i % len(paths)]; returns (results, errors).
+    barrier = threading.Barrier(callers)
+    results, errors = [], []
+    lock = threading.Lock()
+
+    def call(i):
+        barrier.wait()
+        try:
+            result = fetch(paths[i % len(paths)])
+        except Exception as exc:
+            with lock:
+                errors.append(exc)
+        else:
+            with lock:
+                results.append(result)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that a herd of concurrent cache misses costs one upstream request per key."
+    )
+    parser.add_argument("--callers", type=int, default=200, help="Concurrent callers per herd")
+    parser.add_argument("--keys", type=int, default=4, help="Distinct keys requested by the herd")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Upstream)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    @budget_cached(ttl=60, cache=BudgetCache())
+    def fetch(path):
+        response = requests.get(base + path, timeout=30)
+        response.raise_for_status()
+        return response.json()
+
+    try:
+        paths = [f"/charts/{i}" for i in range(args.keys)]
+        started = time.monotonic()
+        results, errors = herd(fetch, paths, args.callers)
+        elapsed = time.monotonic() - started
+        assert not errors, errors
+        assert len(results) == args.callers
+        assert sorted(Upstream.hits) == paths, f"{len(Upstream.hits)} upstream requests for {args.keys} keys"
+        print(f"{args.callers} callers, {args.keys} keys: {len(Upstream.hits)} upstream requests in {elapsed:.2f}s")
+
+        # A failing upstream is also called once, every waiter gets its error, and nothing is cached.
+        Upstream.hits.clear()
+        results, errors = herd(fetch, ["/fail"], args.callers)
+        assert not results and len(errors) == args.callers
+        assert all(isinstance(exc, requests.HTTPError) for exc in errors), errors[:3]
+        assert Upstream.hits == ["/fail"], f"{len(Upstream.hits)} upstream requests for a failing key"
+        herd(fetch, ["/fail"], args.callers)
+        assert Upstream.hits == ["/fail", "/fail"], "a failed fetch was cached"
+        print(f"{args.callers} callers, failing key: one upstream request per herd, {len(errors)} errors shared")
+        print(fetch_flights.stats())
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
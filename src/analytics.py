@@ -0,0 +1,181 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Bounded so a long-lived server process does not accumulate every window a user ever tried.
+_INDICATOR_CACHE_SIZE = 64
+_indicator_cache = OrderedDict()
+_indicator_lock = threading.Lock()
+
+
+def series_version(df, value_col: str = None):
+    value_col = value_col or df.columns[1]
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(df["date"].to_numpy().astype("datetime64[ns]").tobytes())
+    digest.update(df[value_col].to_numpy(dtype="float64").tobytes())
+    return f"{len(df)}:{digest.hexdigest()}"
+
+
+def _compute_indicators(dates, values, window: int, band_pct: float, z_threshold: float):
+    # The window spans `window` calendar days, not rows: long spans come sampled every few days.
+    series = pd.Series(values, index=pd.DatetimeIndex(dates))
+    step_days = series.index.to_series().diff().median() / pd.Timedelta(days=1) if len(series) > 1 else 1.0
+    min_periods = max(2, int(window / max(step_days, 1.0)) // 2)
+    rolling = series.rolling(f"{window}D", min_periods=min_periods)
+
+    mean = rolling.mean()
+    std = rolling.std()
+    zscore = (series - mean) / std.replace(0, np.nan)
+
+    out = pd.DataFrame(
+        {
+            "value": series,
+            "mean": mean,
+            "std": std,
+            "zscore": zscore,
+            "lower": rolling.quantile(band_pct),
+            "upper": rolling.quantile(1 - band_pct),
+        }
+    )
+    out["anomaly"] = np.abs(out["zscore"].to_numpy()) > z_threshold
+    out.index.name = "date"
+    return out.reset_index()
+
+
+def rolling_indicators(df, window: int = 30, band_pct: float = 0.1, z_threshold: float = 3.0):
+    value_col = df.columns[1]
+    ordered = df.sort_values("date")
+    key = (series_version(ordered, value_col), window, band_pct, z_threshold)
+
+    with _indicator_lock:
+        cached = _indicator_cache.get(key)
+        if cached is not None:
+            _indicator_cache.move_to_end(key)
+            return cached
+
+    result = _compute_indicators(
+        ordered["date"].to_numpy(),
+        ordered[value_col].to_numpy(dtype="float64"),
+        window,
+        band_pct,
+        z_threshold,
+    )
+    with _indicator_lock:
+        _indicator_cache[key] = result
+        if len(_indicator_cache) > _INDICATOR_CACHE_SIZE:
+            _indicator_cache.popitem(last=False)
+    return result
+
+
+ROLLUP_FREQS = {"weekly": "W", "monthly": "M", "yearly": "Y"}
+
+_rollups = {}
+_rollups_lock = threading.Lock()
+
+
+def _aggregate(points, freq: str):
+    table = points.groupby(points.index.to_period(freq)).agg(["mean", "sum", "last", "count"])
+    table.index.name = "period"
+    return table
+
+
+class ChartRollups:
+    def __init__(self):
+        self.points = pd.Series(dtype="float64")
+        self.tables = {}
+        self.latest = None
+        self.latest_date = None
+        self.delta_7d = None
+
+    def update(self, df):
+        value_col = df.columns[1]
+        incoming = pd.Series(
+            df[value_col].to_numpy(dtype="float64"),
+            index=pd.DatetimeIndex(df["date"]),
+        ).sort_index()
+        if not self.points.empty:
+            # Points already seen are immutable; only dates past the last sync are folded in.
+            incoming = incoming[incoming.index > self.points.index[-1]]
+        if incoming.empty:
+            return self
+
+        self.points = pd.concat([self.points, incoming]) if not self.points.empty else incoming
+        first_new = incoming.index[0]
+
+        for name, freq in ROLLUP_FREQS.items():
+            # Only the periods touched by the new points are re-aggregated.
+            start = first_new.to_period(freq).start_time
+            fresh = _aggregate(self.points.iloc[self.points.index.searchsorted(start):], freq)
+            table = self.tables.get(name)
+            if table is not None:
+                table = pd.concat([table[table.index < fresh.index[0]].drop(columns="pct_change"), fresh])
+            else:
+                table = fresh
+            table["pct_change"] = table["mean"].pct_change()
+            self.tables[name] = table
+
+        self.latest_date = self.points.index[-1]
+        self.latest = self.points.iloc[-1]
+        previous = self.points.asof(self.latest_date - pd.Timedelta(days=7))
+        if pd.isna(previous):
+            previous = self.points.iloc[0]
+        self.delta_7d = self.latest - previous
+        return self
+
+    def table(self, name: str):
+        return self.tables[name]
+
+
+def chart_rollups(chart: str, timespan: str, df):
+    with _rollups_lock:
+        rollups = _rollups.setdefault((chart, timespan), ChartRollups())
+        return rollups.update(df)
+
+
+def align_metrics(frames: dict, max_gap_days: int = 7):
+    columns = {}
+    for name, df in frames.items():
+        if df.empty:
+            continue
+        series = pd.Series(
+            df[df.columns[1]].to_numpy(dtype="float64"),
+            index=pd.DatetimeIndex(df["date"]).normalize(),
+        )
+        columns[name] = series[~series.index.duplicated(keep="last")]
+
+    aligned = pd.DataFrame(columns).sort_index()
+    if aligned.empty:
+        return aligned.index, aligned.columns.tolist(), aligned.to_numpy(dtype="float64")
+    # Long spans come sampled every few days, on different grids per chart. Rows are put on a daily
+    # calendar so windows and % changes downstream are per day; gaps are interpolated over time, and
+    # only up to max_gap_days.
+    calendar = pd.date_range(aligned.index[0], aligned.index[-1], freq="D")
+    aligned = aligned.reindex(calendar).interpolate(method="time", limit=max_gap_days, limit_area="inside")
+    aligned = aligned.dropna()
+    return aligned.index, aligned.columns.tolist(), aligned.to_numpy(dtype="float64")
+
+
+def rolling_correlations(matrix, window: int):
+    x = np.asarray(matrix, dtype="float64")
+    rows, n = x.shape
+    if rows < window:
+        return np.empty((0, n, n))
+
+    # Windowed sums of x and of every pairwise product come from two cumulative sums,
+    # so all N x N correlations for every window are produced in one vectorized pass.
+    x = x - x.mean(axis=0)
+    sums = np.concatenate([np.zeros((1, n)), np.cumsum(x, axis=0)])
+    products = np.concatenate(
+        [np.zeros((1, n, n)), np.cumsum(x[:, :, None] * x[:, None, :], axis=0)]
+    )
+    s1 = sums[window:] - sums[:-window]
+    s2 = products[window:] - products[:-window]
+
+    cov = s2 - s1[:, :, None] * s1[:, None, :] / window
+    var = np.diagonal(cov, axis1=1, axis2=2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        corr = cov / np.sqrt(var[:, :, None] * var[:, None, :])
+    return np.clip(corr, -1.0, 1.0)
@@ -0,0 +1,470 @@
+import functools
+import hashlib
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+try:
+    import redis
+except Exception:  # pragma: no cover - optional dependency for local envs
+    redis = None
+
+from utils import DATA_DIR
+
+# Shared by every Signal Desk fetcher. Keys come from free-text input, so the budget bounds memory
+# however many distinct queries a public deployment sees.
+CACHE_MAX_BYTES = int(float(os.environ.get("SIGNAL_HUB_CACHE_MB", "256")) * 1024 * 1024)
+CACHE_POLICY = os.environ.get("SIGNAL_HUB_CACHE_POLICY", "lru")
+# Cache shared by all replicas: unset for none, "disk" (or a SQLite path) for a store on a shared
+# volume, or a redis:// URL for any Redis-compatible server.
+SHARED_CACHE = os.environ.get("SIGNAL_HUB_SHARED_CACHE", "")
+SHARED_CACHE_DB = os.path.join(DATA_DIR, "shared_cache.sqlite3")
+SHARED_CACHE_MAX_BYTES = int(float(os.environ.get("SIGNAL_HUB_SHARED_CACHE_MB", "1024")) * 1024 * 1024)
+# How long one replica may hold the right to fetch a key before others stop waiting for it.
+FETCH_LEASE = 300
+WAIT_INTERVAL = 0.25
+
+
+def array_size(value):
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    usage = value.memory_usage(deep=True)
+    return int(usage.sum() if isinstance(usage, pd.Series) else usage)
+
+
+def size_of(value, _seen=None, arrays=None):
+    # Approximate bytes held by a cached value: exact for frames and arrays, recursive for containers
+    # and plain objects, counting shared objects once. When an arrays dict is passed, frames and arrays
+    # are collected there by id instead of being counted, so a caller can charge them separately.
+    _seen = set() if _seen is None else _seen
+    if id(value) in _seen:
+        return 0
+    _seen.add(id(value))
+
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index, np.ndarray)):
+        if arrays is not None:
+            arrays[id(value)] = value
+            return 0
+        return array_size(value)
+    if isinstance(value, (str, bytes, bytearray, int, float, bool, type(None))):
+        return sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            size_of(key, _seen, arrays) + size_of(item, _seen, arrays) for key, item in value.items()
+        )
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(size_of(item, _seen, arrays) for item in value)
+    if hasattr(value, "__dict__"):
+        return sys.getsizeof(value) + size_of(vars(value), _seen, arrays)
+    return sys.getsizeof(value)
+
+
+class BudgetCache:
+    # In-memory cache bounded by total bytes rather than entry count. "lru" evicts the least recently
+    # used entry; "lfu" the least often used, oldest first among equals. Values are shared, not copied,
+    # so callers must not mutate what they get back.
+    # Frames and arrays are charged once however many entries hold them (a dataset bundle holds the
+    # frame of the fetch it was built from) and freed with the last entry holding them. Entries put
+    # with grows=True fill lazy indexes after they are cached and are re-measured on every hit.
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES, policy: str = CACHE_POLICY):
+        if policy not in ("lru", "lfu"):
+            raise ValueError(f"Unknown cache policy: {policy}")
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.entries = OrderedDict()
+        # id -> [array, bytes, number of entries holding it]
+        self.arrays = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.rejections = 0
+        self.lock = threading.Lock()
+
+    def _measure(self, value):
+        # (bytes outside frames and arrays, {id: array}, {id: bytes} for arrays not charged yet). The
+        # deep measurement of new frames runs outside the lock.
+        arrays = {}
+        own = size_of(value, arrays=arrays)
+        sizes = {ident: array_size(array) for ident, array in arrays.items() if ident not in self.arrays}
+        return own, arrays, sizes
+
+    def _hold(self, arrays, sizes):
+        for ident, array in arrays.items():
+            held = self.arrays.get(ident)
+            if held is None:
+                size = sizes[ident] if ident in sizes else array_size(array)
+                self.arrays[ident] = [array, size, 1]
+                self.bytes += size
+            else:
+                held[2] += 1
+
+    def _release(self, arrays):
+        for ident in arrays:
+            held = self.arrays[ident]
+            held[2] -= 1
+            if held[2] == 0:
+                del self.arrays[ident]
+                self.bytes -= held[1]
+
+    def _drop(self, key):
+        entry = self.entries.pop(key)
+        self.bytes -= entry["own"]
+        self._release(entry["arrays"])
+
+    def _remeasure(self, entry):
+        own, arrays, sizes = self._measure(entry["value"])
+        self._hold(arrays, sizes)
+        self._release(entry["arrays"])
+        self.bytes += own - entry["own"]
+        entry["own"], entry["arrays"] = own, arrays
+
+    def get(self, key, count: bool = True):
+        # Returns (found, value). count=False re-checks a key without touching the hit/miss stats.
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry["expires"] is not None and time.monotonic() >= entry["expires"]:
+                self._drop(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += count
+                return False, None
+            entry["uses"] += 1
+            self.entries.move_to_end(key)
+            self.hits += count
+            if entry["grows"]:
+                self._remeasure(entry)
+                self._evict(keep=key)
+            return True, entry["value"]
+
+    def put(self, key, value, ttl: float = None, grows: bool = False):
+        own, arrays, sizes = self._measure(value)
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            if own + sum(sizes.get(ident) or self.arrays[ident][1] for ident in arrays) > self.max_bytes:
+                # Caching it would flush everything else and still not fit.
+                self.rejections += 1
+                return
+            expires = time.monotonic() + ttl if ttl else None
+            self.entries[key] = {
+                "value": value, "own": own, "arrays": arrays, "expires": expires, "uses": 0, "grows": grows
+            }
+            self.bytes += own
+            self._hold(arrays, sizes)
+            self._evict(keep=key)
+
+    def _evict(self, keep):
+        # Evicting an entry frees only what no other entry still holds, so this may take several.
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            self._drop(self._victim(keep))
+            self.evictions += 1
+
+    def _victim(self, keep):
+        candidates = (key for key in self.entries if key != keep)
+        if self.policy == "lru":
+            return next(candidates)
+        # Entries are kept in recency order, so min() breaks ties by the least recently used.
+        return min(candidates, key=lambda key: self.entries[key]["uses"])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.arrays.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "policy": self.policy,
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "rejections": self.rejections,
+            }
+
+
+class SingleFlight:
+    # Coalesces concurrent calls for the same key within this process: the first caller runs the
+    # function and everyone arriving while it is in flight waits for its result (or its exception).
+    def __init__(self):
+        self.flights = {}
+        self.calls = 0
+        self.coalesced = 0
+        self.lock = threading.Lock()
+
+    def do(self, key, func):
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = self.flights[key] = {"done": threading.Event(), "value": None, "error": None}
+                self.calls += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            flight["done"].wait()
+            if flight["error"] is not None:
+                raise flight["error"]
+            return flight["value"]
+
+        try:
+            flight["value"] = func()
+            return flight["value"]
+        except BaseException as error:
+            flight["error"] = error
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight["done"].set()
+
+    def stats(self):
+        with self.lock:
+            return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self.flights)}
+
+
+def shared_key(key):
+    return "signal-hub:v1:" + hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+
+
+class DiskBackend:
+    # SQLite store on a volume all replicas mount. Values are pickled; the least recently read entries
+    # are dropped once the file holds more than max_bytes of values.
+    def __init__(self, path: str = SHARED_CACHE_DB, max_bytes: int = SHARED_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # Default rollback journal: WAL needs shared memory between processes, which network
+            # filesystems do not provide.
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+                "expires REAL, accessed REAL NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);"
+                "CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL);"
+            )
+        return self._conn
+
+    def get(self, key: str):
+        now = time.time()
+        with self.lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value FROM entries WHERE key = ? AND (expires IS NULL OR expires > ?)", (key, now)
+            ).fetchone()
+            if row is None:
+                return False, None
+            conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            conn.commit()
+        return True, pickle.loads(row[0])
+
+    def put(self, key: str, value, ttl: float = None):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes:
+            return
+        now = time.time()
+        with self.lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), now + ttl if ttl else None, now),
+            )
+            conn.execute("DELETE FROM entries WHERE expires IS NOT NULL AND expires <= ?", (now,))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total > self.max_bytes:
+                # Walk entries from least recently read and drop them until the rest fits.
+                excess = total - self.max_bytes
+                stale = []
+                for stale_key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed"):
+                    if excess <= 0:
+                        break
+                    if stale_key != key:
+                        stale.append((stale_key,))
+                        excess -= size
+                conn.executemany("DELETE FROM entries WHERE key = ?", stale)
+            conn.commit()
+
+    def acquire(self, key: str, owner: str, lease: float):
+        now = time.time()
+        with self.lock:
+            conn = self._connect()
+            changed = conn.execute(
+                "INSERT INTO leases (key, owner, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET owner = excluded.owner, expires = excluded.expires "
+                "WHERE leases.expires <= ?",
+                (key, owner, now + lease, now),
+            ).rowcount
+            conn.commit()
+        return changed == 1
+
+    def release(self, key: str, owner: str):
+        with self.lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner))
+            conn.commit()
+
+
+class RedisBackend:
+    # Any Redis-compatible server (Redis, Valkey, KeyDB, Dragonfly). Memory is bounded by the
+    # server's own maxmemory policy, e.g. allkeys-lru. Values are pickled, so only point this at a
+    # server the app trusts.
+    _RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+    def __init__(self, url: str):
+        if redis is None:
+            raise RuntimeError("redis is not installed. Run `pip install -r requirements.txt`.")
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key: str):
+        raw = self.client.get(key)
+        if raw is None:
+            return False, None
+        return True, pickle.loads(raw)
+
+    def put(self, key: str, value, ttl: float = None):
+        self.client.set(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), px=int(ttl * 1000) if ttl else None)
+
+    def acquire(self, key: str, owner: str, lease: float):
+        return bool(self.client.set(f"{key}:lease", owner, nx=True, px=int(lease * 1000)))
+
+    def release(self, key: str, owner: str):
+        self.client.eval(self._RELEASE, 1, f"{key}:lease", owner)
+
+
+def open_backend(spec: str):
+    if not spec:
+        return None
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(spec)
+    return DiskBackend(SHARED_CACHE_DB if spec == "disk" else spec)
+
+
+fetch_cache = BudgetCache()
+fetch_flights = SingleFlight()
+shared_backend = open_backend(SHARED_CACHE)
+shared_stats = {"hits": 0, "fetches": 0, "waits": 0, "errors": 0}
+_shared_stats_lock = threading.Lock()
+
+
+def _count(stat: str):
+    with _shared_stats_lock:
+        shared_stats[stat] += 1
+
+
+def _shared_call(func, args, kwargs, key, ttl):
+    # One replica takes a lease on the key and fetches; the others poll the backend for its result
+    # instead of calling upstream too. A replica that gives up waiting fetches for itself.
+    backend = shared_backend
+    name = shared_key(key)
+    owner = uuid.uuid4().hex
+    acquired = False
+    try:
+        found, value = backend.get(name)
+        if found:
+            _count("hits")
+            return value
+        acquired = backend.acquire(name, owner, FETCH_LEASE)
+        if not acquired:
+            _count("waits")
+            deadline = time.monotonic() + FETCH_LEASE
+            while time.monotonic() < deadline:
+                time.sleep(WAIT_INTERVAL)
+                found, value = backend.get(name)
+                if found:
+                    _count("hits")
+                    return value
+                acquired = backend.acquire(name, owner, FETCH_LEASE)
+                if acquired:
+                    break
+        # The previous holder may have stored the value just before releasing its lease.
+        found, value = backend.get(name)
+        if found:
+            _count("hits")
+            _release(backend, name, owner, acquired)
+            return value
+    except Exception:
+        # The shared cache is an optimisation; an unreachable backend must not break the page. A lease
+        # taken before the failure is released so other replicas do not wait it out.
+        _count("errors")
+        _release(backend, name, owner, acquired)
+        return func(*args, **kwargs)
+
+    try:
+        _count("fetches")
+        value = func(*args, **kwargs)
+        try:
+            backend.put(name, value, ttl)
+        except Exception:
+            # The value was fetched; failing to share it (backend down, unpicklable) only costs reuse.
+            _count("errors")
+        return value
+    finally:
+        _release(backend, name, owner, acquired)
+
+
+def _release(backend, name, owner, acquired):
+    if not acquired:
+        return
+    try:
+        backend.release(name, owner)
+    except Exception:
+        _count("errors")
+
+
+def budget_cached(ttl: float = None, cache: BudgetCache = None, shared: bool = False, grows: bool = False):
+    # Memoizes a function in the shared byte-budgeted cache, keyed on its name and arguments.
+    # Concurrent misses on one key share a single call. With shared=True a local miss goes to the
+    # cross-replica backend (when one is configured) before calling the function; only use it for
+    # picklable results. grows=True for results that build lazy indexes after being cached.
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            target = cache or fetch_cache
+            key = (func.__module__, func.__qualname__, args, tuple(sorted(kwargs.items())))
+            found, value = target.get(key)
+            if found:
+                return value
+
+            def load():
+                # A flight that finished between our miss and joining may already have stored it.
+                found, value = target.get(key, count=False)
+                if found:
+                    return value
+                if shared and shared_backend is not None:
+                    value = _shared_call(func, args, kwargs, key, ttl)
+                else:
+                    value = func(*args, **kwargs)
+                target.put(key, value, ttl, grows)
+                return value
+
+            return fetch_flights.do(key, load)
+
+        return wrapper
+
+    return decorator
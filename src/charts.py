@@ -0,0 +1,64 @@
+import numpy as np
+import plotly.graph_objects as go
+import plotly.io as pio
+
+# Point budget per on-chain chart; a few hundred points already saturate a typical chart width.
+MAX_CHART_POINTS = 600
+# Series longer than this are drawn with WebGL. The check is on the length before downsampling, so
+# long spans switch even though only MAX_CHART_POINTS of their points reach the browser.
+WEBGL_THRESHOLD = 1000
+
+
+def lttb_indices(x, y, threshold: int):
+    """Largest-Triangle-Three-Buckets: pick indices that preserve the visual shape of a line."""
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # The first and last points are always kept; the rest is split into threshold - 2 buckets.
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    prev = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start = edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        bucket_x = x[start:end]
+        bucket_y = y[start:end]
+        area = np.abs(
+            (x[prev] - avg_x) * (bucket_y - y[prev]) - (x[prev] - bucket_x) * (avg_y - y[prev])
+        )
+        prev = start + int(np.nanargmax(area)) if np.isfinite(area).any() else start
+        selected[i + 1] = prev
+
+    return selected
+
+
+def downsample(df, x_col: str, y_col: str, max_points: int = MAX_CHART_POINTS):
+    if len(df) <= max_points:
+        return df
+    clean = df.dropna(subset=[y_col])
+    x = clean[x_col]
+    if np.issubdtype(x.dtype, np.datetime64):
+        x = x.astype("int64")
+    idx = lttb_indices(x.to_numpy(), clean[y_col].to_numpy(), max_points)
+    return clean.iloc[idx]
+
+
+def line_trace(x, y, name: str, webgl_threshold: int = WEBGL_THRESHOLD, source_points: int = None):
+    # source_points is the series length before downsampling; it defaults to the points plotted.
+    points = len(x) if source_points is None else source_points
+    trace_cls = go.Scattergl if points > webgl_threshold else go.Scatter
+    return trace_cls(x=x, y=y, mode="lines", name=name)
+
+
+def payload_bytes(x, y):
+    return len(pio.to_json({"x": x, "y": y}, validate=False))
@@ -0,0 +1,172 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import requests
+
+from utils import DATA_DIR
+
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+USER_AGENT = "BitcoinSignalHub/1.0"
+GEOCODE_DB = os.path.join(DATA_DIR, "geocode.sqlite3")
+
+# Hits are stable for a long time; misses are retried sooner in case of a typo fix upstream.
+HIT_TTL = 30 * 24 * 3600
+MISS_TTL = 24 * 3600
+# Boundary polygons are simplified to about this many degrees (~200 m), which keeps a country's
+# outline to a few thousand points.
+BOUNDARY_TOLERANCE = 0.002
+
+ALIASES = {
+    "usa": "united states",
+    "us": "united states",
+    "u s": "united states",
+    "u s a": "united states",
+    "united states of america": "united states",
+    "america": "united states",
+    "uk": "united kingdom",
+    "u k": "united kingdom",
+    "great britain": "united kingdom",
+    "britain": "united kingdom",
+    "uae": "united arab emirates",
+    "drc": "democratic republic of the congo",
+}
+
+
+def normalize_query(query: str):
+    parts = []
+    for part in query.split(","):
+        part = re.sub(r"[^\w\s-]", " ", part.lower())
+        part = " ".join(part.split())
+        if part:
+            parts.append(ALIASES.get(part, part))
+    return ", ".join(parts)
+
+
+class TokenBucket:
+    def __init__(self, rate: float = 1.0, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                time.sleep((1 - self.tokens) / self.rate)
+
+
+class GeocodeStore:
+    def __init__(self, path: str = GEOCODE_DB):
+        self.path = path
+        self.lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS geocodes ("
+                "key TEXT PRIMARY KEY, result TEXT, fetched_at REAL NOT NULL)"
+            )
+        return self._conn
+
+    def get(self, key: str):
+        # Returns (found, result); result is None for a cached miss.
+        with self.lock:
+            row = self._connect().execute(
+                "SELECT result, fetched_at FROM geocodes WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return False, None
+        result = json.loads(row[0]) if row[0] else None
+        ttl = HIT_TTL if result is not None else MISS_TTL
+        if time.time() - row[1] > ttl:
+            return False, None
+        return True, result
+
+    def put(self, key: str, result):
+        with self.lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO geocodes (key, result, fetched_at) VALUES (?, ?, ?)",
+                (key, json.dumps(result) if result is not None else None, time.time()),
+            )
+            conn.commit()
+
+
+# Nominatim's usage policy allows at most one request per second per application.
+_bucket = TokenBucket(rate=1.0, capacity=1)
+_store = GeocodeStore()
+
+
+def _fetch(query: str, boundary: bool = False):
+    params = {
+        "format": "json",
+        "limit": 1,
+        "q": query,
+        "addressdetails": 1,
+        "accept-language": "en",
+        "extratags": 1,
+    }
+    if boundary:
+        params["polygon_geojson"] = 1
+        params["polygon_threshold"] = BOUNDARY_TOLERANCE
+    _bucket.acquire()
+    response = requests.get(
+        NOMINATIM_URL, params=params, headers={"User-Agent": USER_AGENT}, timeout=20
+    )
+    response.raise_for_status()
+    results = response.json()
+    if not results:
+        return None
+    return results[0]
+
+
+def geocode(query: str, boundary: bool = False):
+    # The normalized key only dedupes the cache; Nominatim gets the text as typed. With boundary=True
+    # the result also carries the place's outline as GeoJSON under "geojson".
+    key = normalize_query(query)
+    if not key:
+        return None
+    if boundary:
+        key = f"{key}|boundary"
+    found, result = _store.get(key)
+    if found:
+        return result
+    result = _fetch(query.strip(), boundary)
+    _store.put(key, result)
+    return result
+
+
+def warm_geocodes(queries):
+    results = {}
+    for query in queries:
+        key = normalize_query(query)
+        if key in results:
+            continue
+        try:
+            results[key] = geocode(query)
+        except Exception:
+            results[key] = None
+    return {query: results.get(normalize_query(query)) for query in queries}
+
+
+def population(result):
+    # Nominatim passes through the OSM population tag, e.g. "8,336,817" or "8336817 (2020)".
+    raw = ((result or {}).get("extratags") or {}).get("population") or ""
+    digits = re.match(r"[\d,. ]+", raw.strip())
+    value = re.sub(r"\D", "", digits.group(0)) if digits else ""
+    return int(value) if value else None
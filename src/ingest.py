@@ -0,0 +1,88 @@
+import pandas as pd
+
+try:
+    import pyarrow.parquet as pq
+except Exception:  # pragma: no cover - optional dependency for local envs
+    pq = None
+
+CHUNK_ROWS = 250_000
+COMPARISON_COLUMNS = ["date", "value"]
+
+
+def _csv_chunks(source):
+    return pd.read_csv(
+        source,
+        usecols=COMPARISON_COLUMNS,
+        # value is left to inference and coerced per chunk, so one malformed cell is skipped instead of
+        # failing the whole upload.
+        dtype={"date": "string"},
+        thousands=",",
+        chunksize=CHUNK_ROWS,
+    )
+
+
+def _parquet_chunks(source):
+    if pq is None:
+        raise RuntimeError("pyarrow is not installed. Run `pip install -r requirements.txt`.")
+    parquet = pq.ParquetFile(source)
+    for batch in parquet.iter_batches(batch_size=CHUNK_ROWS, columns=COMPARISON_COLUMNS):
+        yield batch.to_pandas()
+
+
+def read_daily_totals(source, filename: str = ""):
+    # Returns the daily totals and the number of rows skipped for an unreadable date or value.
+    chunks = _parquet_chunks(source) if filename.lower().endswith(".parquet") else _csv_chunks(source)
+
+    # Each chunk is collapsed to one row per day, so memory scales with the date range, not the row count.
+    partials = []
+    skipped = 0
+    for chunk in chunks:
+        dates = pd.to_datetime(chunk["date"], errors="coerce").dt.normalize()
+        values = chunk["value"]
+        if not pd.api.types.is_numeric_dtype(values):
+            # A malformed cell leaves the whole chunk as text, thousands separators included.
+            values = values.astype("string").str.replace(",", "", regex=False)
+        values = pd.to_numeric(values, errors="coerce").astype("float64")
+        skipped += int((dates.isna() | values.isna()).sum())
+        daily = values.groupby(dates).agg(["sum", "count"])
+        partials.append(daily)
+
+    if not partials:
+        return pd.Series(dtype="float64", name="value"), skipped
+
+    combined = pd.concat(partials).groupby(level=0).sum()
+    combined = combined[combined["count"] > 0]
+    totals = combined["sum"].rename("value")
+    totals.index.name = "date"
+    return totals.sort_index(), skipped
+
+
+def infer_frequency(dates):
+    if len(dates) < 2:
+        return "D"
+    spacing = pd.Series(dates).diff().dt.days.median()
+    if spacing >= 28:
+        return "M"
+    if spacing >= 7:
+        return "W"
+    return "D"
+
+
+def to_frequency(series, freq: str):
+    periods = series.index.to_period(freq)
+    resampled = series.groupby(periods).sum()
+    resampled.index = resampled.index.to_timestamp()
+    resampled.index.name = "date"
+    return resampled
+
+
+def align_asof(left, right, freq: str):
+    tolerance = {"D": 1, "W": 4, "M": 16}[freq]
+    merged = pd.merge_asof(
+        left.reset_index().sort_values("date"),
+        right.reset_index().sort_values("date"),
+        on="date",
+        direction="nearest",
+        tolerance=pd.Timedelta(days=tolerance),
+    )
+    return merged.dropna()
@@ -0,0 +1,525 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from geocode import geocode, normalize_query
+from merchants import MerchantRows, element_values
+from overpass import (
+    OverpassTimeout,
+    TileLayoutStore,
+    call_overpass,
+    fetch_quadtree,
+    legacy_only,
+    osm_area_id,
+    overpass_query_area,
+    overpass_query_bbox,
+)
+from spatial import AdminIndex, assign_admin_regions, geometry_polygons
+from utils import DATA_DIR
+
+MERCHANT_DB = os.path.join(DATA_DIR, "merchants.sqlite3")
+# Seed tiles for the worldwide ingest; the Overpass quadtree splits dense ones further.
+WORLD_TILE_DEGREES = 30
+WRITE_BATCH = 2000
+# Refreshes ask Overpass for changes since the last sync minus this overlap, because mirrors lag the
+# main database; replaying an already applied edit is harmless. Syncs older than FULL_RESYNC_AGE are
+# redone in full, since a long augmented diff costs the server more than a fresh download.
+SYNC_OVERLAP = 3600
+FULL_RESYNC_AGE = 30 * 24 * 3600
+# A region synced more recently than this is served from its snapshot without asking Overpass, so
+# replicas and repeated batch comparisons do not resend the same diff.
+MIN_SYNC_INTERVAL = 15 * 60
+# Regions loaded at once by a batch comparison. Overpass mirror slots and the Nominatim rate limit
+# still apply underneath, so extra workers only queue.
+BATCH_WORKERS = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS merchants (
+    id INTEGER PRIMARY KEY,
+    osm_type TEXT NOT NULL,
+    osm_id INTEGER NOT NULL,
+    name TEXT,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    city TEXT,
+    state TEXT,
+    country TEXT,
+    category TEXT,
+    first_seen TEXT,
+    osm_timestamp TEXT,
+    legacy_only INTEGER,
+    seen_at REAL NOT NULL,
+    UNIQUE (osm_type, osm_id)
+);
+CREATE INDEX IF NOT EXISTS merchants_admin ON merchants (country, state, city);
+CREATE VIRTUAL TABLE IF NOT EXISTS merchants_rtree USING rtree (
+    id, min_lat, max_lat, min_lon, max_lon
+);
+CREATE TABLE IF NOT EXISTS ingest_runs (
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    merchants INTEGER,
+    include_legacy INTEGER
+);
+CREATE TABLE IF NOT EXISTS region_merchants (
+    region TEXT NOT NULL,
+    osm_type TEXT NOT NULL,
+    osm_id INTEGER NOT NULL,
+    name TEXT,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    city TEXT,
+    state TEXT,
+    country TEXT,
+    category TEXT,
+    first_seen TEXT,
+    osm_timestamp TEXT,
+    legacy_only INTEGER,
+    seen_at REAL NOT NULL,
+    PRIMARY KEY (region, osm_type, osm_id)
+);
+CREATE TABLE IF NOT EXISTS region_syncs (
+    region TEXT PRIMARY KEY,
+    synced_at REAL NOT NULL,
+    scope TEXT NOT NULL
+);
+"""
+
+_SELECT_COLUMNS = (
+    "m.osm_type, m.osm_id, m.name, m.lat, m.lon, m.city, m.state, m.country, m.category, m.first_seen"
+)
+_UPSERT_COLUMNS = (
+    "osm_type, osm_id, name, lat, lon, city, state, country, category, first_seen, osm_timestamp, "
+    "legacy_only, seen_at"
+)
+# An edit moves the OSM timestamp forward, but the merchant was already there: first_seen only
+# ever moves back.
+_UPDATE_COLUMNS = (
+    "name = excluded.name, lat = excluded.lat, lon = excluded.lon, city = excluded.city, "
+    "state = excluded.state, country = excluded.country, category = excluded.category, "
+    "first_seen = COALESCE(MIN(first_seen, excluded.first_seen), first_seen, excluded.first_seen), "
+    "osm_timestamp = excluded.osm_timestamp, legacy_only = excluded.legacy_only, seen_at = excluded.seen_at"
+)
+# Columns added after the first release of the store, created on older databases when opened.
+_ADDED_COLUMNS = {
+    "merchants": {"first_seen": "TEXT", "osm_timestamp": "TEXT", "legacy_only": "INTEGER"},
+    "region_merchants": {"first_seen": "TEXT", "legacy_only": "INTEGER"},
+    "ingest_runs": {"include_legacy": "INTEGER"},
+}
+
+
+def osm_time(timestamp: float):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(timestamp))
+
+
+def world_tiles(step: int = WORLD_TILE_DEGREES):
+    return [
+        (south, west, min(south + step, 90), min(west + step, 180))
+        for south in range(-90, 90, step)
+        for west in range(-180, 180, step)
+    ]
+
+
+class MerchantStore:
+    def __init__(self, path: str = MERCHANT_DB):
+        self.path = path
+        self.lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.executescript(SCHEMA)
+            for table, added in _ADDED_COLUMNS.items():
+                columns = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+                for column, kind in added.items():
+                    if column not in columns:
+                        self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind}")
+        return self._conn
+
+    def last_ingest(self, include_legacy: bool = False):
+        # When the store last finished a run covering the requested tags: a run that included the
+        # legacy tag also answers queries without it. Runs from before the tag set was recorded
+        # cover nothing.
+        with self.lock:
+            row = self._connect().execute(
+                "SELECT MAX(finished_at) FROM ingest_runs WHERE finished_at IS NOT NULL AND include_legacy >= ?",
+                (int(include_legacy),),
+            ).fetchone()
+        return row[0]
+
+    def last_sync(self, include_legacy: bool):
+        with self.lock:
+            row = self._connect().execute(
+                "SELECT MAX(started_at) FROM ingest_runs WHERE finished_at IS NOT NULL AND include_legacy = ?",
+                (int(include_legacy),),
+            ).fetchone()
+        return row[0]
+
+    def count(self):
+        with self.lock:
+            return self._connect().execute("SELECT COUNT(*) FROM merchants").fetchone()[0]
+
+    def upsert(self, rows, seen_at: float, region: str = None):
+        # rows are element_values() tuples followed by the element's OSM timestamp and whether it
+        # matched only the legacy tag. With a region the rows go to that region's snapshot instead of
+        # the worldwide table.
+        with self.lock:
+            conn = self._connect()
+            for key, name, lat, lon, city, state, country, category, since, osm_timestamp, legacy in rows:
+                values = (
+                    *key, name, lat, lon, city, state, country, category, since, osm_timestamp, int(legacy), seen_at
+                )
+                if region is not None:
+                    conn.execute(
+                        f"INSERT INTO region_merchants (region, {_UPSERT_COLUMNS}) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                        f"ON CONFLICT (region, osm_type, osm_id) DO UPDATE SET {_UPDATE_COLUMNS}",
+                        (region, *values),
+                    )
+                    continue
+                row_id = conn.execute(
+                    f"INSERT INTO merchants ({_UPSERT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    f"ON CONFLICT (osm_type, osm_id) DO UPDATE SET {_UPDATE_COLUMNS} "
+                    "RETURNING id",
+                    values,
+                ).fetchone()[0]
+                conn.execute(
+                    "INSERT OR REPLACE INTO merchants_rtree VALUES (?, ?, ?, ?, ?)",
+                    (row_id, lat, lat, lon, lon),
+                )
+            conn.commit()
+
+    def delete(self, keys, region: str = None):
+        removed = 0
+        with self.lock:
+            conn = self._connect()
+            for osm_type, osm_id in keys:
+                if region is not None:
+                    removed += conn.execute(
+                        "DELETE FROM region_merchants WHERE region = ? AND osm_type = ? AND osm_id = ?",
+                        (region, osm_type, osm_id),
+                    ).rowcount
+                    continue
+                row = conn.execute(
+                    "DELETE FROM merchants WHERE osm_type = ? AND osm_id = ? RETURNING id",
+                    (osm_type, osm_id),
+                ).fetchone()
+                if row is not None:
+                    conn.execute("DELETE FROM merchants_rtree WHERE id = ?", row)
+                    removed += 1
+            conn.commit()
+        return removed
+
+    def prune(self, seen_before: float, region: str = None, include_legacy: bool = True):
+        # Merchants not seen by a complete ingest have lost their tags or been deleted upstream. A run
+        # without the legacy tag never sees legacy-only merchants, so it leaves them to the next run
+        # that does; otherwise it would void the coverage last_ingest reports for legacy queries.
+        scope = "seen_at < ?" if include_legacy else "seen_at < ? AND legacy_only = 0"
+        with self.lock:
+            conn = self._connect()
+            if region is not None:
+                removed = conn.execute(
+                    f"DELETE FROM region_merchants WHERE region = ? AND {scope}", (region, seen_before)
+                ).rowcount
+                conn.commit()
+                return removed
+            conn.execute(
+                f"DELETE FROM merchants_rtree WHERE id IN (SELECT id FROM merchants WHERE {scope})",
+                (seen_before,),
+            )
+            removed = conn.execute(f"DELETE FROM merchants WHERE {scope}", (seen_before,)).rowcount
+            conn.commit()
+        return removed
+
+    def record_run(self, started_at: float, finished_at: float, merchants: int, include_legacy: bool):
+        with self.lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT INTO ingest_runs (started_at, finished_at, merchants, include_legacy) VALUES (?, ?, ?, ?)",
+                (started_at, finished_at, merchants, int(include_legacy)),
+            )
+            conn.commit()
+
+    def _frame(self, sql: str, params, fallback_country: str):
+        rows = MerchantRows(fallback_country)
+        with self.lock:
+            for osm_type, osm_id, *values in self._connect().execute(sql, params):
+                rows.add_values((osm_type, osm_id), *values)
+        return rows.to_frame()
+
+    def query_bbox(
+        self,
+        south: float,
+        west: float,
+        north: float,
+        east: float,
+        include_legacy: bool = True,
+        fallback_country: str = "",
+    ):
+        # A box crossing the antimeridian (west > east) is queried as its two halves.
+        ranges = [(west, east)] if west <= east else [(west, 180.0), (-180.0, east)]
+        sql = (
+            f"SELECT {_SELECT_COLUMNS} FROM merchants_rtree r JOIN merchants m ON m.id = r.id "
+            "WHERE r.min_lat >= ? AND r.max_lat <= ? AND ("
+            + " OR ".join("(r.min_lon >= ? AND r.max_lon <= ?)" for _ in ranges)
+            + ")"
+        )
+        params = [south, north, *(bound for lon_range in ranges for bound in lon_range)]
+        if not include_legacy:
+            sql += " AND m.legacy_only = 0"
+        return self._frame(sql, params, fallback_country)
+
+    def query_area(self, geometry, include_legacy: bool = True, fallback_country: str = ""):
+        # Merchants inside a GeoJSON (Multi)Polygon. The R*Tree narrows each part to its bounding box and
+        # a point-in-polygon test keeps only the merchants within the outline itself.
+        index = AdminIndex([("area", rings) for rings in geometry_polygons(geometry)])
+        candidates = {}
+        with self.lock:
+            conn = self._connect()
+            for west, south, east, north in index.boxes:
+                for row_id, lat, lon in conn.execute(
+                    "SELECT id, min_lat, min_lon FROM merchants_rtree "
+                    "WHERE min_lat >= ? AND max_lat <= ? AND min_lon >= ? AND max_lon <= ?",
+                    (south, north, west, east),
+                ):
+                    candidates[row_id] = (lat, lon)
+        ids = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        coords = np.array(list(candidates.values()), dtype="float64").reshape(-1, 2)
+        inside = ids[pd.notna(index.assign(coords[:, 0], coords[:, 1]))] if len(ids) else ids
+        sql = f"SELECT {_SELECT_COLUMNS} FROM merchants m WHERE m.id IN (SELECT value FROM json_each(?))"
+        if not include_legacy:
+            sql += " AND m.legacy_only = 0"
+        return self._frame(sql, (json.dumps(inside.tolist()),), fallback_country)
+
+    def region_sync(self, region: str):
+        # (synced_at, scope) of the region's last complete sync, or None.
+        with self.lock:
+            return self._connect().execute(
+                "SELECT synced_at, scope FROM region_syncs WHERE region = ?", (region,)
+            ).fetchone()
+
+    def mark_region_synced(self, region: str, synced_at: float, scope: str):
+        with self.lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO region_syncs (region, synced_at, scope) VALUES (?, ?, ?)",
+                (region, synced_at, scope),
+            )
+            conn.commit()
+
+    def region_frame(self, region: str, fallback_country: str = ""):
+        sql = f"SELECT {_SELECT_COLUMNS} FROM region_merchants m WHERE m.region = ?"
+        return self._frame(sql, (region,), fallback_country)
+
+
+class StoreWriter:
+    # Streaming sink for call_overpass / fetch_quadtree: buffers parsed elements and upserts them in batches.
+    # Elements from an augmented diff marked as deleted are removed when the writer is flushed, unless
+    # another tile of the same refresh delivered the same or a newer version: a merchant that moved
+    # between tiles leaves one tile's diff as a delete and enters the other's as a create.
+    def __init__(self, store: MerchantStore, seen_at: float, region: str = None):
+        self.store = store
+        self.seen_at = seen_at
+        self.region = region
+        self.buffer = []
+        self.deleted = []
+        self.upserted = {}
+        self.written = 0
+        self.removed = 0
+        self.lock = threading.Lock()
+
+    def add(self, el):
+        if el.get("action") == "delete":
+            with self.lock:
+                self.deleted.append(((el["type"], el["id"]), el.get("timestamp") or ""))
+            return
+        values = element_values(el)
+        if values is None:
+            return
+        with self.lock:
+            self.upserted[values[0]] = max(self.upserted.get(values[0], ""), el.get("timestamp") or "")
+            self.buffer.append((*values, el.get("timestamp"), legacy_only(el.get("tags", {}))))
+            if len(self.buffer) < WRITE_BATCH:
+                return
+            batch, self.buffer = self.buffer, []
+        self.store.upsert(batch, self.seen_at, self.region)
+        with self.lock:
+            self.written += len(batch)
+
+    def flush(self):
+        with self.lock:
+            batch, self.buffer = self.buffer, []
+            deleted = [
+                key for key, timestamp in self.deleted if key not in self.upserted or self.upserted[key] < timestamp
+            ]
+            self.deleted = []
+        if batch:
+            self.store.upsert(batch, self.seen_at, self.region)
+        removed = self.store.delete(deleted, self.region) if deleted else 0
+        with self.lock:
+            self.written += len(batch)
+            self.removed += removed
+        return self.written
+
+
+def ingest_world(store: MerchantStore, include_legacy: bool = True, layouts: TileLayoutStore = None):
+    layouts = layouts or TileLayoutStore()
+    layout_key = f"world|legacy={include_legacy}"
+    started_at = time.time()
+    writer = StoreWriter(store, started_at)
+    layout = fetch_quadtree(
+        (-90, -180, 90, 180),
+        lambda tile: overpass_query_bbox(*tile, include_legacy),
+        writer.add,
+        layout=layouts.get(layout_key) or world_tiles(),
+    )
+    layouts.put(layout_key, layout)
+    writer.flush()
+    # Only a run that covered every tile can tell which merchants disappeared.
+    removed = store.prune(started_at, include_legacy=include_legacy)
+    stored = store.count()
+    store.record_run(started_at, time.time(), stored, include_legacy)
+    return stored, removed
+
+
+def refresh_world(store: MerchantStore, include_legacy: bool = True, layouts: TileLayoutStore = None):
+    # Applies only the edits made since the last run, so the transfer scales with OSM activity rather
+    # than with the number of merchants. Falls back to a full ingest when there is nothing recent to
+    # build on.
+    last_sync = store.last_sync(include_legacy)
+    started_at = time.time()
+    if last_sync is None or started_at - last_sync > FULL_RESYNC_AGE:
+        return ingest_world(store, include_legacy, layouts)
+
+    layouts = layouts or TileLayoutStore()
+    since = osm_time(last_sync - SYNC_OVERLAP)
+    writer = StoreWriter(store, started_at)
+    fetch_quadtree(
+        (-90, -180, 90, 180),
+        lambda tile: overpass_query_bbox(*tile, include_legacy, since=since),
+        writer.add,
+        layout=layouts.get(f"world|legacy={include_legacy}") or world_tiles(),
+    )
+    writer.flush()
+    stored = store.count()
+    store.record_run(started_at, time.time(), stored, include_legacy)
+    return stored, writer.removed
+
+
+def sync_region(
+    store: MerchantStore,
+    region: str,
+    area_id: int,
+    bbox,
+    include_legacy: bool = True,
+    layouts: TileLayoutStore = None,
+):
+    # Keeps the region's snapshot current. The first sync downloads the area (or, when the area query
+    # fails, a quadtree of bbox tiles); later syncs apply an augmented diff over the same scope.
+    layouts = layouts or TileLayoutStore()
+    started_at = time.time()
+    synced = store.region_sync(region)
+    if synced is not None and started_at - synced[0] < MIN_SYNC_INTERVAL:
+        return
+
+    if synced is not None and started_at - synced[0] <= FULL_RESYNC_AGE:
+        synced_at, scope = synced
+        since = osm_time(synced_at - SYNC_OVERLAP)
+        writer = StoreWriter(store, started_at, region)
+        try:
+            if scope == "area":
+                call_overpass(overpass_query_area(area_id, include_legacy, since=since), writer.add)
+            else:
+                fetch_quadtree(
+                    bbox,
+                    lambda tile: overpass_query_bbox(*tile, include_legacy, since=since),
+                    writer.add,
+                    layout=layouts.get(region),
+                )
+        except OverpassTimeout:
+            # A diff that cannot finish is no cheaper than a full download; redo the region below.
+            pass
+        else:
+            writer.flush()
+            store.mark_region_synced(region, started_at, scope)
+            return
+
+    writer = StoreWriter(store, started_at, region)
+    scope = None
+    if area_id is not None:
+        try:
+            if call_overpass(overpass_query_area(area_id, include_legacy), writer.add) > 0:
+                scope = "area"
+        except OverpassTimeout:
+            pass
+
+    if scope is None and bbox is not None:
+        # Large countries often fail in a single area query. Fall back to a quadtree of bbox tiles whose
+        # split layout is remembered per region, so later runs start at the density that worked.
+        layout = fetch_quadtree(
+            bbox,
+            lambda tile: overpass_query_bbox(*tile, include_legacy),
+            writer.add,
+            layout=layouts.get(region),
+        )
+        layouts.put(region, layout)
+        scope = "bbox"
+
+    writer.flush()
+    store.prune(started_at, region, include_legacy)
+    if scope is not None:
+        store.mark_region_synced(region, started_at, scope)
+
+
+def load_region(store: MerchantStore, name: str, include_legacy: bool = True, layouts: TileLayoutStore = None):
+    # Merchants in a named country or state/province as (frame, geocoder result).
+    # Once a worldwide ingest covering the requested tags has run, the region is answered from the
+    # local store by its boundary polygon; a bbox would also take in neighbouring regions.
+    covered = store.last_ingest(include_legacy) is not None
+    geo = geocode(name, boundary=covered)
+    if not geo:
+        raise RuntimeError("Country not found in geocoder.")
+    geo = dict(geo)
+    boundary = geo.pop("geojson", None)
+
+    bbox = geo.get("boundingbox")
+    if bbox and len(bbox) == 4:
+        south, north, west, east = map(float, bbox)
+        bbox = (south, west, north, east)
+    else:
+        bbox = None
+    # Labels merchants without an addr:country tag; a state's display name is not a country.
+    fallback_country = (geo.get("address") or {}).get("country") or geo.get("display_name", name)
+
+    if covered and geometry_polygons(boundary):
+        frame = store.query_area(boundary, include_legacy, fallback_country)
+        return assign_admin_regions(frame), geo
+
+    # Each region is kept as a snapshot in the local store; after the first download, a cache expiry
+    # only pulls the OSM edits made since the previous sync.
+    region = f"{normalize_query(name)}|legacy={include_legacy}"
+    sync_region(store, region, osm_area_id(geo["osm_type"], geo["osm_id"]), bbox, include_legacy, layouts)
+    return assign_admin_regions(store.region_frame(region, fallback_country)), geo
+
+
+def load_regions(names, load, workers: int = BATCH_WORKERS):
+    # Calls load(name) for each region concurrently and yields (name, result, error) as soon as each
+    # finishes, in completion order.
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(load, name): name for name in names}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as exc:
+                yield futures[future], None, exc
+            else:
+                yield futures[future], result, None
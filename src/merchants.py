@@ -0,0 +1,243 @@
+import datetime
+import re
+import threading
+from array import array
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+CATEGORICAL_COLUMNS = ("city", "state", "country", "category", "source")
+MERCHANT_COLUMNS = ["name", "lat", "lon", *CATEGORICAL_COLUMNS, "first_seen"]
+SOURCE = "OpenStreetMap tags"
+# Tags recording when a mapper last confirmed the merchant on the ground.
+DATE_TAGS = ("check_date", "survey:date")
+_DATE_PATTERN = re.compile(r"(\d{4})-(\d{2})(?:-(\d{2}))?")
+_NO_DATE = -(2**31)
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+def first_seen(el):
+    # Earliest date the element is known to carry its tags: the OSM timestamp of the current version,
+    # or an earlier check_date / survey:date. An upper bound on when the merchant started accepting
+    # bitcoin, as "YYYY-MM-DD", or None.
+    tags = el.get("tags", {})
+    dates = []
+    for raw in (el.get("timestamp"), *(tags.get(tag) for tag in DATE_TAGS)):
+        match = _DATE_PATTERN.match(raw or "")
+        if not match:
+            continue
+        # Mappers write impossible dates such as 2023-02-30 or 2023-04-00; those are dropped.
+        try:
+            day = match.group(3) or "01"
+            dates.append(datetime.date.fromisoformat(f"{match.group(1)}-{match.group(2)}-{day}"))
+        except ValueError:
+            continue
+    return min(dates).isoformat() if dates else None
+
+
+def _epoch_days(since):
+    # Stores written before first_seen() validated dates can still hold values like "2023-02-30".
+    try:
+        return int(datetime.date.fromisoformat(since).toordinal() - _EPOCH_ORDINAL) if since else _NO_DATE
+    except ValueError:
+        return _NO_DATE
+
+
+def element_values(el):
+    # (key, name, lat, lon, city, state, country tag, category, first seen) for an Overpass element,
+    # or None when it has no usable position.
+    if el.get("type") == "node" or "lat" in el:
+        lat = el.get("lat")
+        lon = el.get("lon")
+    else:
+        center = el.get("center") or {}
+        lat = center.get("lat")
+        lon = center.get("lon")
+
+    if lat is None or lon is None:
+        return None
+
+    tags = el.get("tags", {})
+    return (
+        (el.get("type"), el.get("id")),
+        tags.get("name"),
+        lat,
+        lon,
+        tags.get("addr:city") or tags.get("city"),
+        tags.get("addr:state") or tags.get("addr:province"),
+        tags.get("addr:country"),
+        tags.get("amenity") or tags.get("shop") or tags.get("tourism"),
+        first_seen(el),
+    )
+
+
+class MerchantRows:
+    # Builds the merchant table column by column straight from streamed elements, deduping by OSM type
+    # and id. Coordinates are packed float32 and repeated strings are stored once as category codes,
+    # so neither the raw response nor one dict per merchant is ever held in memory.
+    def __init__(self, fallback_country: str):
+        self.fallback_country = fallback_country
+        self.names = []
+        self.lat = array("f")
+        self.lon = array("f")
+        self.codes = {column: array("i") for column in CATEGORICAL_COLUMNS}
+        self.levels = {column: {} for column in CATEGORICAL_COLUMNS}
+        self.first_seen = array("i")
+        self.seen = set()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def _code(self, column: str, value):
+        if not value:
+            return -1
+        levels = self.levels[column]
+        code = levels.get(value)
+        if code is None:
+            code = levels[value] = len(levels)
+        return code
+
+    def add(self, el):
+        values = element_values(el)
+        if values is not None:
+            self.add_values(*values)
+
+    def add_values(self, key, name, lat, lon, city, state, country, category, since=None):
+        with self.lock:
+            if key in self.seen:
+                return
+            self.seen.add(key)
+            self.names.append(name or "Unknown")
+            self.lat.append(lat)
+            self.lon.append(lon)
+            row = {
+                "city": city,
+                "state": state,
+                "country": country or self.fallback_country,
+                "category": category,
+                "source": SOURCE,
+            }
+            for column, value in row.items():
+                self.codes[column].append(self._code(column, value))
+            # Stored as days since the epoch to keep the column packed like the coordinates.
+            self.first_seen.append(_epoch_days(since))
+
+    def to_frame(self):
+        with self.lock:
+            data = {
+                "name": pd.Series(self.names, dtype="string"),
+                "lat": np.frombuffer(self.lat, dtype=np.float32).copy(),
+                "lon": np.frombuffer(self.lon, dtype=np.float32).copy(),
+            }
+            for column in CATEGORICAL_COLUMNS:
+                data[column] = pd.Categorical.from_codes(
+                    np.frombuffer(self.codes[column], dtype=np.int32),
+                    categories=list(self.levels[column]),
+                )
+            days = np.frombuffer(self.first_seen, dtype=np.int32).astype(np.int64)
+        data["first_seen"] = np.where(days == _NO_DATE, np.datetime64("NaT"), days.astype("datetime64[D]"))
+        data["first_seen"] = data["first_seen"].astype("datetime64[s]")
+        return pd.DataFrame(data, columns=MERCHANT_COLUMNS)
+
+
+def tag_counts(series):
+    # value_counts on a categorical also lists categories with no rows left after filtering.
+    counts = series.value_counts()
+    return counts[counts > 0]
+
+
+def filter_mask(df, **equals):
+    mask = np.ones(len(df), dtype=bool)
+    for column, value in equals.items():
+        if value is not None:
+            mask &= (df[column] == value).to_numpy(dtype=bool, na_value=False)
+    return mask
+
+
+def category_mix(df, top: int = 5):
+    # Share of merchants per category: the top categories, then everything else (untagged included).
+    counts = tag_counts(df["category"])
+    shares = (counts.head(top) / len(df)) if len(df) else counts.head(0).astype("float64")
+    other = 1.0 - shares.sum() if len(df) else 0.0
+    if other > 1e-9:
+        shares = pd.concat([shares, pd.Series({"(other)": other})])
+    return shares.rename_axis("category")
+
+
+def adoption_timeline(df, by: str = None, freq: str = "M"):
+    # Cumulative merchant counts per period, from each merchant's first_seen date. With `by`, one column
+    # per value of that column (e.g. state); otherwise a single "merchants" column. Undated rows are left out.
+    dated = df[df["first_seen"].notna()]
+    if dated.empty:
+        return pd.DataFrame(index=pd.PeriodIndex([], freq=freq))
+    periods = dated["first_seen"].dt.to_period(freq)
+    if by:
+        table = dated.groupby([periods, dated[by]], observed=True).size().unstack(fill_value=0)
+    else:
+        table = periods.value_counts().to_frame("merchants")
+    full = pd.period_range(periods.min(), periods.max(), freq=freq)
+    return table.reindex(full, fill_value=0).cumsum()
+
+
+CUBE_DIMENSIONS = ("country", "state", "city", "category")
+
+
+class MerchantCube:
+    # Merchant counts per (country, state, city, category) cell. The cells are built with one vectorized
+    # groupby and far fewer than the rows; every count, breakdown and value list the merchant tab asks for
+    # is derived from them once and then served from a memo until more rows are added.
+    def __init__(self):
+        self.cells = Counter()
+        self._memo = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_frame(cls, df):
+        cube = cls()
+        cube.add(df)
+        return cube
+
+    def add(self, df):
+        if df.empty:
+            return self
+        grouped = df.groupby(list(CUBE_DIMENSIONS), observed=True, dropna=False).size()
+        increments = Counter()
+        for key, count in grouped.items():
+            increments[tuple(None if pd.isna(value) else value for value in key)] += int(count)
+        with self.lock:
+            self.cells.update(increments)
+            self._memo.clear()
+        return self
+
+    def _matching(self, filters):
+        positions = [(CUBE_DIMENSIONS.index(name), value) for name, value in filters if value is not None]
+        for key, count in self.cells.items():
+            if all(key[position] == value for position, value in positions):
+                yield key, count
+
+    def breakdown(self, dimension: str, **filters):
+        memo_key = ("breakdown", dimension, tuple(sorted(filters.items())))
+        with self.lock:
+            cached = self._memo.get(memo_key)
+            if cached is None:
+                position = CUBE_DIMENSIONS.index(dimension)
+                totals = Counter()
+                for key, count in self._matching(memo_key[2]):
+                    if key[position] is not None:
+                        totals[key[position]] += count
+                cached = pd.Series(dict(totals.most_common()), dtype="int64").rename_axis(dimension)
+                self._memo[memo_key] = cached
+        return cached
+
+    def count(self, **filters):
+        memo_key = ("count", tuple(sorted(filters.items())))
+        with self.lock:
+            cached = self._memo.get(memo_key)
+            if cached is None:
+                cached = self._memo[memo_key] = sum(count for _, count in self._matching(memo_key[1]))
+        return cached
+
+    def values(self, dimension: str, **filters):
+        return sorted(self.breakdown(dimension, **filters).index.tolist())
@@ -1,5 +1,6 @@
 from collections import Counter
 
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 import requests
@@ -12,6 +13,17 @@ except Exception:  # pragma: no cover - optional dependency for local envs
 
 import xml.etree.ElementTree as ET
 
+from analytics import align_metrics, chart_rollups, rolling_correlations, rolling_indicators
+from cache import budget_cached, fetch_cache, fetch_flights, shared_backend, shared_stats
+from charts import MAX_CHART_POINTS, downsample, line_trace, payload_bytes
+from geocode import population, warm_geocodes
+from ingest import align_asof, infer_frequency, read_daily_totals, to_frequency
+from merchant_store import MerchantStore, load_region, load_regions
+from merchants import MerchantCube, adoption_timeline, category_mix, filter_mask
+from overpass import TileLayoutStore, endpoint_manager
+from search import MerchantSearch, page, page_count
+from spatial import group_centroids, timelapse_cells, zoom_for_span
+from tiles import CELLS_PER_TILE, FrameTiles, export_in_background
 from utils import format_compact
 
 BLOCKCHAIN_API = "https://api.blockchain.info/charts"
@@ -32,7 +44,7 @@ def show_content():
     )
 
     tabs = st.tabs(
-        ["Primer", "Comparative Lens", "On-Chain Signals", "Merchant Adoption", "Daily Brief"],
+        ["Primer", "Comparative Lens", "On-Chain Signals", "Correlations", "Merchant Adoption", "Daily Brief"],
     )
 
     with tabs[0]:
@@ -45,11 +57,35 @@ def show_content():
         render_onchain()
 
     with tabs[3]:
-        render_merchants()
+        render_correlations()
 
     with tabs[4]:
+        render_merchants()
+        render_region_comparison()
+
+    with tabs[5]:
         render_brief()
 
+    with st.expander("Data cache"):
+        stats = fetch_cache.stats()
+        st.caption(
+            f"{stats['entries']} entries, {format_compact(stats['bytes'])}B of "
+            f"{format_compact(stats['max_bytes'])}B ({stats['policy'].upper()}). Hit rate {stats['hit_rate']:.0%} "
+            f"over {format_compact(stats['hits'] + stats['misses'])} lookups; {stats['evictions']} evictions, "
+            f"{stats['expirations']} expirations, {stats['rejections']} values too large to cache."
+        )
+        if shared_backend is not None:
+            st.caption(
+                f"Shared {type(shared_backend).__name__.removesuffix('Backend').lower()} cache: "
+                f"{shared_stats['hits']} hits, {shared_stats['fetches']} upstream fetches, "
+                f"{shared_stats['waits']} waits on another replica, {shared_stats['errors']} errors."
+            )
+        flights = fetch_flights.stats()
+        st.caption(
+            f"{flights['calls']} loads, {flights['coalesced']} concurrent requests served by a load "
+            f"already in flight, {flights['in_flight']} in flight now."
+        )
+
     st.markdown("---")
     st.markdown("### References")
     st.markdown(
@@ -175,7 +211,7 @@ def render_comparison():
 # On-chain data
 # ----------------------------
 
-@st.cache_data(ttl=3600)
+@budget_cached(ttl=3600, shared=True)
 def fetch_blockchain_chart(chart: str, timespan: str = "1year"):
     url = f"{BLOCKCHAIN_API}/{chart}?timespan={timespan}&format=json"
     response = requests.get(url, timeout=20)
@@ -190,6 +226,27 @@ def fetch_blockchain_chart(chart: str, timespan: str = "1year"):
     return payload, df
 
 
+def render_line_chart(df, name: str, max_points: int = MAX_CHART_POINTS):
+    value_col = df.columns[1]
+    plotted = downsample(df, "date", value_col, max_points)
+
+    fig = go.Figure()
+    fig.add_trace(line_trace(plotted["date"], plotted[value_col], name, source_points=len(df)))
+    fig.update_layout(
+        margin=dict(l=10, r=10, t=20, b=10),
+        yaxis=dict(tickformat=".2s"),
+    )
+    st.plotly_chart(fig, use_container_width=True)
+
+    if len(plotted) < len(df):
+        before = payload_bytes(df["date"], df[value_col])
+        after = payload_bytes(plotted["date"], plotted[value_col])
+        st.caption(
+            f"Downsampled {format_compact(len(df))} → {format_compact(len(plotted))} points "
+            f"(payload {format_compact(before)}B → {format_compact(after)}B)."
+        )
+
+
 def render_onchain():
     st.header("On-Chain Signals")
 
@@ -200,62 +257,72 @@ def render_onchain():
         """
     )
 
+    spans = {"1 year": "1year", "5 years": "5years", "All time": "all"}
+    span_label = st.selectbox("Time span", list(spans.keys()), key="onchain_span")
+    span = spans[span_label]
+
     col1, col2 = st.columns(2)
 
     with col1:
-        st.subheader("Active addresses (last 1Y)")
+        st.subheader(f"Active addresses ({span_label})")
         try:
-            meta, df = fetch_blockchain_chart("n-unique-addresses", "1year")
-            fig = go.Figure()
-            fig.add_trace(
-                go.Scatter(
-                    x=df["date"],
-                    y=df[df.columns[1]],
-                    mode="lines",
-                    name="Active addresses",
-                )
-            )
-            fig.update_layout(
-                margin=dict(l=10, r=10, t=20, b=10),
-                yaxis=dict(tickformat=".2s"),
-            )
-            st.plotly_chart(fig, use_container_width=True)
+            meta, df = fetch_blockchain_chart("n-unique-addresses", span)
+            render_line_chart(df, "Active addresses")
             st.caption(meta.get("description", "Unique addresses used on the network."))
         except Exception:
             st.warning("Unable to load active address data right now.")
 
     with col2:
-        st.subheader("Transactions per day (last 1Y)")
+        st.subheader(f"Transactions per day ({span_label})")
         try:
-            meta, df = fetch_blockchain_chart("n-transactions", "1year")
-            fig = go.Figure()
-            fig.add_trace(
-                go.Scatter(
-                    x=df["date"],
-                    y=df[df.columns[1]],
-                    mode="lines",
-                    name="Transactions",
-                )
-            )
-            fig.update_layout(
-                margin=dict(l=10, r=10, t=20, b=10),
-                yaxis=dict(tickformat=".2s"),
-            )
-            st.plotly_chart(fig, use_container_width=True)
+            meta, df = fetch_blockchain_chart("n-transactions", span)
+            render_line_chart(df, "Transactions")
             st.caption(meta.get("description", "Confirmed transactions per day."))
         except Exception:
             st.warning("Unable to load transaction data right now.")
 
-    st.subheader("Estimated transaction volume (USD, last 1Y)")
+    st.subheader(f"Estimated transaction volume (USD, {span_label})")
     try:
-        meta, df = fetch_blockchain_chart("estimated-transaction-volume-usd", "1year")
+        meta, df = fetch_blockchain_chart("estimated-transaction-volume-usd", span)
+        render_line_chart(df, "USD volume")
+        st.caption(meta.get("description", "Estimated transaction volume in USD."))
+    except Exception:
+        st.warning("Unable to load transaction volume data right now.")
+
+    st.subheader("Rolling signals")
+    st.caption(
+        "Rolling mean with percentile bands. Points more than 3 standard deviations from the rolling mean are flagged."
+    )
+    signal_charts = {
+        "Active addresses": "n-unique-addresses",
+        "Transactions": "n-transactions",
+        "USD volume": "estimated-transaction-volume-usd",
+    }
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        signal_label = st.selectbox("Metric", list(signal_charts.keys()), key="rolling_metric")
+    with col2:
+        window = st.slider("Window (days)", 7, 180, 30, step=1, key="rolling_window")
+    try:
+        _, df = fetch_blockchain_chart(signal_charts[signal_label], span)
+        signals = rolling_indicators(df, window=window)
+        plotted = downsample(signals, "date", "value")
+
         fig = go.Figure()
+        points = len(signals)
+        fig.add_trace(line_trace(plotted["date"], plotted["upper"], "Upper band", source_points=points))
+        fig.add_trace(line_trace(plotted["date"], plotted["lower"], "Lower band", source_points=points))
+        fig.data[-1].update(fill="tonexty")
+        fig.add_trace(line_trace(plotted["date"], plotted["value"], signal_label, source_points=points))
+        fig.add_trace(line_trace(plotted["date"], plotted["mean"], f"{window}d mean", source_points=points))
+
+        anomalies = signals[signals["anomaly"]]
         fig.add_trace(
             go.Scatter(
-                x=df["date"],
-                y=df[df.columns[1]],
-                mode="lines",
-                name="USD volume",
+                x=anomalies["date"],
+                y=anomalies["value"],
+                mode="markers",
+                name="Anomaly",
             )
         )
         fig.update_layout(
@@ -263,9 +330,9 @@ def render_onchain():
             yaxis=dict(tickformat=".2s"),
         )
         st.plotly_chart(fig, use_container_width=True)
-        st.caption(meta.get("description", "Estimated transaction volume in USD."))
+        st.caption(f"{format_compact(len(anomalies))} anomalous days in this span.")
     except Exception:
-        st.warning("Unable to load transaction volume data right now.")
+        st.warning("Unable to compute rolling signals right now.")
 
     st.subheader("YoY growth in active addresses (proxy, 5Y)")
     st.caption(
@@ -273,13 +340,12 @@ def render_onchain():
     )
     try:
         _, df = fetch_blockchain_chart("n-unique-addresses", "5years")
-        df = df.set_index("date").resample("Y").mean()
-        df["YoY %"] = df.iloc[:, 0].pct_change() * 100
+        yearly = chart_rollups("n-unique-addresses", "5years", df).table("yearly")
         fig = go.Figure()
         fig.add_trace(
             go.Bar(
-                x=df.index.year.astype(str),
-                y=df["YoY %"],
+                x=yearly.index.astype(str),
+                y=yearly["pct_change"] * 100,
                 name="YoY %",
             )
         )
@@ -294,27 +360,31 @@ def render_onchain():
     st.subheader("Compare with USD online transaction volume")
     st.markdown(
         """
-        Upload a CSV with `date` and `value` columns (daily or monthly) to compare
-        Bitcoin on-chain volume with another payment dataset.
+        Upload a CSV or Parquet file with `date` and `value` columns (daily, weekly, or monthly) to compare
+        Bitcoin on-chain volume with another payment dataset. Rows are summed per day, then both series are
+        aligned at the upload's frequency.
         """
     )
-    uploaded = st.file_uploader("Upload comparison CSV", type=["csv"])
+    uploaded = st.file_uploader("Upload comparison file", type=["csv", "parquet"])
     if uploaded:
         try:
-            external = pd.read_csv(uploaded)
-            external["date"] = pd.to_datetime(external["date"])
-            external = external.rename(columns={"value": "External Volume"})
+            external, skipped = read_daily_totals(uploaded, uploaded.name)
+            if skipped:
+                st.caption(f"Skipped {skipped:,} rows with an unreadable date or value.")
+            freq = infer_frequency(external.index)
+            external = to_frequency(external, freq).rename("External Volume")
 
             _, btc = fetch_blockchain_chart("estimated-transaction-volume-usd", "1year")
-            btc = btc.rename(columns={btc.columns[1]: "Bitcoin Volume"})
+            btc = pd.Series(btc[btc.columns[1]].to_numpy(), index=pd.DatetimeIndex(btc["date"]))
+            btc = to_frequency(btc, freq).rename("Bitcoin Volume")
 
-            merged = pd.merge(btc[["date", "Bitcoin Volume"]], external[["date", "External Volume"]], on="date", how="inner")
+            merged = align_asof(btc, external, freq)
             if merged.empty:
-                st.warning("No matching dates found between the two datasets.")
+                st.warning("No overlapping dates found between the two datasets.")
             else:
                 st.line_chart(merged.set_index("date"))
         except Exception:
-            st.warning("Failed to parse the CSV. Ensure it has `date` and `value` columns.")
+            st.warning("Failed to parse the file. Ensure it has `date` and `value` columns.")
 
     st.markdown("### Metrics that require premium data sources")
     st.markdown(
@@ -330,200 +400,265 @@ def render_onchain():
 
 
 # ----------------------------
-# Merchant adoption map
+# Correlations
 # ----------------------------
 
-@st.cache_data(ttl=21600)
-def geocode_country(country_name: str):
-    url = "https://nominatim.openstreetmap.org/search"
-    params = {
-        "format": "json",
-        "limit": 1,
-        "q": country_name,
-        "addressdetails": 1,
-        "accept-language": "en",
-        "extratags": 1,
-    }
-    headers = {"User-Agent": "BitcoinSignalHub/1.0"}
-    response = requests.get(url, params=params, headers=headers, timeout=20)
-    response.raise_for_status()
-    results = response.json()
-    if not results:
-        return None
-    return results[0]
-
-
-def _area_id(osm_type: str, osm_id: int):
-    if osm_type == "relation":
-        return 3600000000 + int(osm_id)
-    if osm_type == "way":
-        return 2400000000 + int(osm_id)
-    return None
-
-
-def _overpass_query_area(area_id: int, include_legacy: bool):
-    legacy_clause = ""
-    if include_legacy:
-        legacy_clause = """
-      node["payment:bitcoin"="yes"](area.searchArea);
-      way["payment:bitcoin"="yes"](area.searchArea);
-      relation["payment:bitcoin"="yes"](area.searchArea);
+CORRELATION_CHARTS = {
+    "Active addresses": "n-unique-addresses",
+    "Transactions": "n-transactions",
+    "USD volume": "estimated-transaction-volume-usd",
+    "Hash rate": "hash-rate",
+    "Mempool size": "mempool-size",
+    "Fees (USD)": "transaction-fees-usd",
+    "Difficulty": "difficulty",
+    "Market price": "market-price",
+    "Miners revenue": "miners-revenue",
+    "Output volume": "output-volume",
+    "Cost per transaction": "cost-per-transaction",
+    "Txns per block": "n-transactions-per-block",
+    "Avg block size": "avg-block-size",
+    "Confirmation time": "median-confirmation-time",
+    "Exchange volume": "trade-volume",
+    "Mempool count": "mempool-count",
+    "Fees per transaction": "fees-usd-per-transaction",
+    "Total bitcoins": "total-bitcoins",
+    "Market cap": "market-cap",
+    "Payments": "n-payments",
+}
+
+
+def render_correlations():
+    st.header("Metric Correlations")
+    st.markdown(
         """
-    return f"""
-    [out:json][timeout:50];
-    area({area_id})->.searchArea;
-    (
-      node["currency:XBT"="yes"](area.searchArea);
-      way["currency:XBT"="yes"](area.searchArea);
-      relation["currency:XBT"="yes"](area.searchArea);
-      node["payment:onchain"="yes"](area.searchArea);
-      way["payment:onchain"="yes"](area.searchArea);
-      relation["payment:onchain"="yes"](area.searchArea);
-      node["payment:lightning"="yes"](area.searchArea);
-      way["payment:lightning"="yes"](area.searchArea);
-      relation["payment:lightning"="yes"](area.searchArea);
-      node["payment:lightning_contactless"="yes"](area.searchArea);
-      way["payment:lightning_contactless"="yes"](area.searchArea);
-      relation["payment:lightning_contactless"="yes"](area.searchArea);
-      {legacy_clause}
-    );
-    out center tags;
-    """
-
-
-def _overpass_query_bbox(south: float, west: float, north: float, east: float, include_legacy: bool):
-    legacy_clause = ""
-    if include_legacy:
-        legacy_clause = f"""
-      node["payment:bitcoin"="yes"]({south},{west},{north},{east});
-      way["payment:bitcoin"="yes"]({south},{west},{north},{east});
-      relation["payment:bitcoin"="yes"]({south},{west},{north},{east});
+        How network activity metrics move together over a rolling window. Correlation is not causation;
+        use this to spot regime changes, not to predict prices.
         """
-    return f"""
-    [out:json][timeout:50];
-    (
-      node["currency:XBT"="yes"]({south},{west},{north},{east});
-      way["currency:XBT"="yes"]({south},{west},{north},{east});
-      relation["currency:XBT"="yes"]({south},{west},{north},{east});
-      node["payment:onchain"="yes"]({south},{west},{north},{east});
-      way["payment:onchain"="yes"]({south},{west},{north},{east});
-      relation["payment:onchain"="yes"]({south},{west},{north},{east});
-      node["payment:lightning"="yes"]({south},{west},{north},{east});
-      way["payment:lightning"="yes"]({south},{west},{north},{east});
-      relation["payment:lightning"="yes"]({south},{west},{north},{east});
-      node["payment:lightning_contactless"="yes"]({south},{west},{north},{east});
-      way["payment:lightning_contactless"="yes"]({south},{west},{north},{east});
-      relation["payment:lightning_contactless"="yes"]({south},{west},{north},{east});
-      {legacy_clause}
-    );
-    out center tags;
-    """
-
-
-def _call_overpass(query: str):
-    endpoints = [
-        "https://overpass-api.de/api/interpreter",
-        "https://overpass.kumi.systems/api/interpreter",
-        "https://overpass.private.coffee/api/interpreter",
-        "https://overpass.nchc.org.tw/api/interpreter",
-    ]
-    payload = None
-    last_error = None
-    for endpoint in endpoints:
-        try:
-            response = requests.post(
-                endpoint,
-                data=query.encode("utf-8"),
-                headers={"User-Agent": "BitcoinSignalHub/1.0"},
-                timeout=90,
-            )
-            response.raise_for_status()
-            payload = response.json()
-            break
-        except Exception as exc:
-            last_error = exc
-            continue
-    if payload is None:
-        raise RuntimeError(f"Overpass query failed: {last_error}")
-    return payload
-
+    )
 
-def _elements_to_rows(elements, fallback_country: str):
-    rows = []
-    seen = set()
-    for el in elements:
-        key = (el.get("type"), el.get("id"))
-        if key in seen:
-            continue
-        seen.add(key)
+    selected = st.multiselect(
+        "Metrics",
+        list(CORRELATION_CHARTS.keys()),
+        default=["Active addresses", "Transactions", "USD volume", "Hash rate", "Mempool size", "Fees (USD)"],
+    )
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        spans = {"1 year": "1year", "5 years": "5years", "All time": "all"}
+        span = spans[st.selectbox("Time span", list(spans.keys()), key="corr_span")]
+    with col2:
+        window = st.slider("Window (days)", 14, 365, 90, step=1, key="corr_window")
+    with col3:
+        basis = st.radio("Correlate", ["Daily % change", "Levels"], key="corr_basis")
 
-        if el.get("type") == "node":
-            lat = el.get("lat")
-            lon = el.get("lon")
-        else:
-            center = el.get("center") or {}
-            lat = center.get("lat")
-            lon = center.get("lon")
+    if len(selected) < 2:
+        st.caption("Select at least two metrics.")
+        return
 
-        if lat is None or lon is None:
-            continue
+    frames = {}
+    for label in selected:
+        try:
+            _, frames[label] = fetch_blockchain_chart(CORRELATION_CHARTS[label], span)
+        except Exception:
+            st.caption(f"Skipped {label}: data unavailable.")
+
+    dates, names, matrix = align_metrics(frames)
+    if basis == "Daily % change":
+        with np.errstate(divide="ignore", invalid="ignore"):
+            matrix = np.diff(matrix, axis=0) / matrix[:-1]
+        matrix = np.nan_to_num(matrix, nan=0.0, posinf=0.0, neginf=0.0)
+        dates = dates[1:]
+
+    correlations = rolling_correlations(matrix, window)
+    if len(names) < 2 or len(correlations) == 0:
+        st.warning("Not enough overlapping history for this window.")
+        return
 
-        tags = el.get("tags", {})
-        rows.append(
-            {
-                "name": tags.get("name", "Unknown"),
-                "lat": lat,
-                "lon": lon,
-                "city": tags.get("addr:city") or tags.get("city"),
-                "state": tags.get("addr:state") or tags.get("addr:province"),
-                "country": tags.get("addr:country") or fallback_country,
-                "category": tags.get("amenity") or tags.get("shop") or tags.get("tourism"),
-                "source": "OpenStreetMap tags",
-            }
+    st.subheader(f"Latest {window}-day correlation")
+    fig = go.Figure(
+        go.Heatmap(
+            z=correlations[-1],
+            x=names,
+            y=names,
+            zmin=-1,
+            zmax=1,
+            colorscale="RdBu",
         )
+    )
+    fig.update_layout(margin=dict(l=10, r=10, t=20, b=10))
+    st.plotly_chart(fig, use_container_width=True)
 
-    return rows
+    st.subheader("Rolling correlation for a pair")
+    col1, col2 = st.columns(2)
+    with col1:
+        first = st.selectbox("First metric", names, index=0, key="corr_first")
+    with col2:
+        second = st.selectbox("Second metric", names, index=1, key="corr_second")
+    i, j = names.index(first), names.index(second)
+    window_ends = dates[window - 1:]
+    fig = go.Figure()
+    fig.add_trace(line_trace(window_ends, correlations[:, i, j], f"{first} vs {second}"))
+    fig.update_layout(
+        margin=dict(l=10, r=10, t=20, b=10),
+        yaxis=dict(range=[-1, 1]),
+    )
+    st.plotly_chart(fig, use_container_width=True)
 
 
-@st.cache_data(ttl=21600)
-def fetch_merchants_for_country(country_name: str, include_legacy: bool):
-    geo = geocode_country(country_name)
-    if not geo:
-        raise RuntimeError("Country not found in geocoder.")
+# ----------------------------
+# Merchant adoption map
+# ----------------------------
 
-    bbox = geo.get("boundingbox")
-    if bbox and len(bbox) == 4:
-        south, north, west, east = map(float, bbox)
-    else:
-        south = north = west = east = None
+_tile_layouts = TileLayoutStore()
+_merchant_store = MerchantStore()
+
+
+@budget_cached(ttl=21600, shared=True)
+def fetch_region(country_name: str, include_legacy: bool):
+    # (frame, geocoder result) for the region.
+    return load_region(_merchant_store, country_name, include_legacy, _tile_layouts)
+
+
+@budget_cached(ttl=21600, grows=True)
+def merchant_dataset(country_name: str, include_legacy: bool):
+    # The rows with the cube, search index and map tiles built from that same frame. Cached
+    # separately, the rows could be evicted and refetched (after an OSM refresh, say) while an older
+    # index still pointed at positions in the previous rows. Counts, breakdowns and filter options are
+    # read from the cube, so reruns never rescan the rows. The Parquet/GeoJSON/MBTiles export for
+    # other tools is written in the background.
+    merchants, _ = fetch_region(country_name, include_legacy)
+    export_in_background(merchants, f"{country_name} legacy={include_legacy}")
+    return (
+        merchants,
+        MerchantCube.from_frame(merchants),
+        MerchantSearch.from_frame(merchants),
+        FrameTiles(merchants["lat"], merchants["lon"]),
+    )
 
-    area_id = _area_id(geo["osm_type"], geo["osm_id"])
 
-    elements = []
-    if area_id is not None:
-        query = _overpass_query_area(area_id, include_legacy)
-        payload = _call_overpass(query)
-        elements = payload.get("elements", [])
+def render_merchant_tiles(tiles, df, max_cells: int):
+    # The viewport is the extent of the rows shown, so focusing on a state reads only its cells.
+    if df.empty:
+        st.caption("No merchant locations to map.")
+        return
+    south, north = float(df["lat"].min()), float(df["lat"].max())
+    west, east = float(df["lon"].min()), float(df["lon"].max())
+    cells, tile_zoom = tiles.view(south, west, north, east, max_cells)
+    if cells.empty:
+        st.caption("No merchant locations to map.")
+        return
+    size = 360 / ((1 << tile_zoom) * CELLS_PER_TILE)
+
+    max_count = cells["count"].max()
+    # Roughly half a cell across at the equator for the densest cell.
+    cells["radius"] = (size * 111_000 / 2) * (0.35 + 0.65 * np.sqrt(cells["count"] / max_count))
+
+    import pydeck as pdk
+
+    layer = pdk.Layer(
+        "ScatterplotLayer",
+        data=cells,
+        get_position="[lon, lat]",
+        get_radius="radius",
+        radius_min_pixels=2,
+        get_fill_color="[209, 136, 47, 170]",
+        pickable=True,
+    )
+    view_state = pdk.ViewState(
+        latitude=(south + north) / 2,
+        longitude=(west + east) / 2,
+        zoom=zoom_for_span(max(north - south, east - west)),
+    )
+    st.pydeck_chart(
+        pdk.Deck(
+            layers=[layer],
+            initial_view_state=view_state,
+            tooltip={"text": "Merchants: {count}"},
+        )
+    )
+    st.caption(
+        f"{format_compact(int(cells['count'].sum()))} merchants in view, drawn as {format_compact(len(cells))} "
+        f"cells of {size:.3g}° from zoom-{tile_zoom} tiles."
+    )
+
 
-    if not elements and None not in (south, north, west, east):
-        # Large countries often fail in a single area query. Split into a 3x3 grid.
-        lat_span = abs(north - south)
-        lon_span = abs(east - west)
-        grid = 3 if (lat_span * lon_span) > 200 else 2
+def render_adoption_history(df, max_cells: int):
+    st.subheader("Adoption over time")
+    dated = int(df["first_seen"].notna().sum())
+    if not dated:
+        st.caption("No dated merchants in this dataset.")
+        return
+    st.caption(
+        f"Each merchant is dated by the earliest of its OSM edit timestamp, check_date and survey:date "
+        f"({format_compact(dated)} of {format_compact(len(df))} dated). That is an upper bound on when it "
+        "started accepting bitcoin, so early growth is understated."
+    )
 
-        lat_step = (north - south) / grid
-        lon_step = (east - west) / grid
-        for i in range(grid):
-            for j in range(grid):
-                s = south + i * lat_step
-                n = south + (i + 1) * lat_step
-                w = west + j * lon_step
-                e = west + (j + 1) * lon_step
-                query = _overpass_query_bbox(s, w, n, e, include_legacy)
-                payload = _call_overpass(query)
-                elements.extend(payload.get("elements", []))
+    total = adoption_timeline(df)
+    by_state = adoption_timeline(df, by="state")
+    fig = go.Figure()
+    fig.add_trace(line_trace(total.index.to_timestamp(), total["merchants"], "All merchants"))
+    if not by_state.empty:
+        for state in by_state.iloc[-1].nlargest(5).index:
+            fig.add_trace(line_trace(by_state.index.to_timestamp(), by_state[state], str(state)))
+    fig.update_layout(margin=dict(l=10, r=10, t=20, b=10), yaxis_title="Merchants (cumulative)")
+    st.plotly_chart(fig, use_container_width=True)
+
+    # Quarterly frames keep the animation short over a decade of OSM history.
+    freq = "M" if len(total) <= 36 else "Q"
+    cells = timelapse_cells(df["lat"], df["lon"], df["first_seen"], max_cells=min(max_cells, 400), freq=freq)
+    periods = list(dict.fromkeys(cells["period"]))
+    max_count = cells["count"].max()
+
+    def frame_trace(period):
+        frame = cells[cells["period"] == period]
+        return go.Scattergeo(
+            lat=frame["lat"],
+            lon=frame["lon"],
+            text=frame["count"],
+            marker=dict(
+                size=frame["count"],
+                sizemode="area",
+                sizeref=2.0 * max_count / 30**2,
+                sizemin=2,
+                color="rgba(209, 136, 47, 0.7)",
+            ),
+            hovertemplate="Merchants: %{text}<extra></extra>",
+        )
 
-    return _elements_to_rows(elements, geo.get("display_name", country_name))
+    fig = go.Figure(
+        data=[frame_trace(periods[0])],
+        frames=[go.Frame(data=[frame_trace(period)], name=period) for period in periods],
+    )
+    fig.update_geos(fitbounds="locations", showcountries=True)
+    fig.update_layout(
+        margin=dict(l=10, r=10, t=20, b=10),
+        updatemenus=[
+            dict(
+                type="buttons",
+                showactive=False,
+                buttons=[
+                    dict(
+                        label="Play",
+                        method="animate",
+                        args=[None, {"frame": {"duration": 300, "redraw": True}, "fromcurrent": True}],
+                    )
+                ],
+            )
+        ],
+        sliders=[
+            dict(
+                steps=[
+                    dict(
+                        label=period,
+                        method="animate",
+                        args=[[period], {"frame": {"duration": 0, "redraw": True}, "mode": "immediate"}],
+                    )
+                    for period in periods
+                ]
+            )
+        ],
+    )
+    st.plotly_chart(fig, use_container_width=True)
 
 
 def render_merchants():
@@ -543,7 +678,7 @@ def render_merchants():
         with col2:
             region = st.text_input("State/Province (optional)", value="")
         with col3:
-            max_points = st.slider("Max map points", 200, 2000, 800, step=100)
+            max_cells = st.slider("Max map cells", 200, 2000, 800, step=100)
         st.caption(
             "Tip: For large countries like the U.S., add a state/province for faster and more reliable results."
         )
@@ -558,21 +693,36 @@ def render_merchants():
         )
         submitted = st.form_submit_button("Load merchants")
 
-    if not submitted:
+    # The loaded query outlives the submit: the search box, pagination and drilldown selects below
+    # rerun the script without the form, and must keep showing the same dataset.
+    if submitted:
+        if not country.strip():
+            st.warning("Enter a country name to load merchants.")
+            return
+        query_name = country.strip()
+        if region.strip():
+            query_name = f"{region.strip()}, {country.strip()}"
+        st.session_state.merchant_query = {
+            "query_name": query_name,
+            "country": country.strip(),
+            "include_legacy": include_legacy,
+            "view_mode": view_mode,
+            "max_cells": max_cells,
+        }
+
+    loaded = st.session_state.get("merchant_query")
+    if loaded is None:
         st.caption("Enter a country (and optionally a state/province) then click Load merchants.")
         return
-
-    if not country.strip():
-        st.warning("Enter a country name to load merchants.")
-        return
-
-    query_name = country.strip()
-    if region.strip():
-        query_name = f"{region.strip()}, {country.strip()}"
+    query_name = loaded["query_name"]
+    country = loaded["country"]
+    include_legacy = loaded["include_legacy"]
+    view_mode = loaded["view_mode"]
+    max_cells = loaded["max_cells"]
 
     with st.spinner("Fetching merchant data..."):
         try:
-            rows = fetch_merchants_for_country(query_name, include_legacy)
+            merchants, cube, search_index, map_tiles = merchant_dataset(query_name, include_legacy)
         except Exception as exc:
             st.error(f"Failed to load merchants: {exc}")
             st.info(
@@ -580,50 +730,58 @@ def render_merchants():
             )
             return
 
-    if not rows:
+    last_ingest = _merchant_store.last_ingest(include_legacy)
+    if last_ingest is not None:
+        ingested = pd.Timestamp(last_ingest, unit="s").strftime("%Y-%m-%d %H:%M UTC")
+        st.caption(f"Served from the local merchant store (last ingest {ingested}).")
+
+    with st.expander("Overpass mirror health"):
+        st.dataframe(pd.DataFrame(endpoint_manager.snapshot()), use_container_width=True, hide_index=True)
+
+    if merchants.empty:
         st.warning("No merchants found for this area.")
         st.info(
             "Try adding a state/province or enabling legacy tags to improve coverage."
         )
         return
 
-    df = pd.DataFrame(rows)
-    if len(df) > max_points:
-        df = df.sample(max_points, random_state=42)
-
-    st.caption(f"{format_compact(len(rows))} locations retrieved before sampling.")
+    df = merchants
+    scope = {}
+    st.caption(f"{format_compact(len(merchants))} locations retrieved.")
 
     if view_mode == "Summary (state-level)":
         st.subheader(f"State-level adoption: {query_name}")
-        state_counts = df["state"].dropna().value_counts()
+        state_counts = cube.breakdown("state")
         if state_counts.empty:
-            st.warning("State-level tags are missing. Switch to Drilldown for merchant map.")
+            st.warning(
+                "State-level tags are missing. Add boundary polygons (see README) or switch to Drilldown."
+            )
         else:
             summary = state_counts.rename_axis("state").reset_index(name="count")
-            summary["country"] = country.strip()
+            summary["country"] = country
             summary = summary.head(50)
 
-            state_points = []
-            for _, row in summary.iterrows():
-                state_geo = geocode_country(f"{row['state']}, {row['country']}")
-                if not state_geo:
-                    continue
-                try:
-                    state_points.append(
-                        {
-                            "state": row["state"],
-                            "count": int(row["count"]),
-                            "lat": float(state_geo["lat"]),
-                            "lon": float(state_geo["lon"]),
-                        }
-                    )
-                except Exception:
-                    continue
-
-            if not state_points:
-                st.warning("Unable to geocode state centroids. Use Drilldown mode.")
+            # Bubbles sit on the located merchants of each state; only states without any fall back to geocoding.
+            centroids = group_centroids(merchants[merchants["state"].isin(summary["state"])], "state")
+            points_df = summary.merge(centroids, on="state", how="left")
+            missing = points_df["lat"].isna()
+            if missing.any():
+                state_queries = [f"{state}, {country}" for state in points_df.loc[missing, "state"]]
+                state_geos = warm_geocodes(state_queries)
+                for idx, query in zip(points_df.index[missing], state_queries):
+                    state_geo = state_geos[query]
+                    if not state_geo:
+                        continue
+                    try:
+                        points_df.loc[idx, ["lat", "lon"]] = [float(state_geo["lat"]), float(state_geo["lon"])]
+                    except Exception:
+                        continue
+            state_points = points_df.dropna(subset=["lat", "lon"])
+
+            if state_points.empty:
+                st.warning("Unable to locate state centroids. Use Drilldown mode.")
             else:
-                points_df = pd.DataFrame(state_points)
+                points_df = state_points[["state", "count", "lat", "lon"]].copy()
                 max_count = points_df["count"].max()
                 points_df["radius"] = points_df["count"].apply(
                     lambda c: 20000 + (c / max_count) * 60000
@@ -669,14 +827,18 @@ def render_merchants():
                 ["All"] + summary["state"].tolist(),
             )
             if selected_state != "All":
+                scope["state"] = selected_state
                 df = df[df["state"] == selected_state]
 
     if view_mode == "Drilldown (merchant-level)":
         st.subheader(f"Merchant map: {query_name}")
-        st.map(df.rename(columns={"lat": "latitude", "lon": "longitude"}))
+        focus = st.selectbox("Focus map on", ["Whole region"] + cube.values("state", **scope))
+        if focus != "Whole region":
+            df = df[df["state"] == focus]
+        render_merchant_tiles(map_tiles, df, max_cells)
 
     st.subheader("Counts by state/region (if tagged)")
-    state_counts = df["state"].dropna().value_counts().head(15)
+    state_counts = cube.breakdown("state", **scope).head(15)
     if state_counts.empty:
         st.caption("No state-level tags found for this country.")
     else:
@@ -685,7 +847,7 @@ def render_merchants():
         st.dataframe(state_df, use_container_width=True)
 
     st.subheader("Counts by city (if tagged)")
-    city_counts = df["city"].dropna().value_counts().head(20)
+    city_counts = cube.breakdown("city", **scope).head(20)
     if city_counts.empty:
         st.caption("No city-level tags found for this country.")
     else:
@@ -693,26 +855,113 @@ def render_merchants():
         city_df["Merchants"] = city_df["Merchants"].apply(format_compact)
         st.dataframe(city_df, use_container_width=True)
 
-    st.subheader("Filter by city or state")
+    render_adoption_history(merchants, max_cells)
+
+    st.subheader("Search and filter")
+    search_query = st.text_input(
+        "Search by name or category",
+        placeholder="e.g. coffee, hotel, bitcoin atm",
+        help="Matches word prefixes and tolerates small typos.",
+    )
     col1, col2 = st.columns(2)
     with col1:
-        city_filter = st.selectbox("City", ["All"] + sorted(df["city"].dropna().unique().tolist()))
+        city_filter = st.selectbox("City", ["All"] + cube.values("city", **scope))
     with col2:
-        state_filter = st.selectbox("State/Region", ["All"] + sorted(df["state"].dropna().unique().tolist()))
+        state_filter = st.selectbox("State/Region", ["All"] + cube.values("state", **scope))
 
-    filtered = df.copy()
-    if city_filter != "All":
-        filtered = filtered[filtered["city"] == city_filter]
-    if state_filter != "All":
-        filtered = filtered[filtered["state"] == state_filter]
-
-    st.caption(f"{format_compact(len(filtered))} locations match filters.")
+    filters = {
+        "city": None if city_filter == "All" else city_filter,
+        "state": None if state_filter == "All" else state_filter,
+    }
+    selected = {**scope, **{name: value for name, value in filters.items() if value is not None}}
+    matches = search_index.search(search_query, filter_mask(merchants, **selected))
+    total = len(matches) if search_query.strip() else cube.count(**selected)
+    st.caption(f"{format_compact(total)} locations match.")
+
+    pages = page_count(len(matches))
+    page_number = st.number_input("Page", min_value=1, max_value=pages, value=1, step=1)
+    st.caption(f"Page {page_number} of {pages}")
     st.dataframe(
-        filtered[["name", "category", "city", "state"]].head(200),
+        merchants.iloc[page(matches, page_number)][["name", "category", "city", "state"]],
         use_container_width=True,
     )
 
 
+MAX_COMPARE_REGIONS = 25
+
+
+def render_region_comparison():
+    st.subheader("Compare regions")
+    with st.form("merchant_compare"):
+        regions_text = st.text_area(
+            "Regions (one per line)",
+            value="El Salvador\nSwitzerland\nGermany\nArgentina\nNigeria\nJapan",
+            help="Countries or 'State, Country' pairs. Regions are fetched in parallel.",
+        )
+        include_legacy = st.checkbox("Include legacy payment:bitcoin tag", value=True, key="compare_legacy")
+        submitted = st.form_submit_button("Compare regions")
+
+    if not submitted:
+        return
+
+    names = list(dict.fromkeys(line.strip() for line in regions_text.splitlines() if line.strip()))
+    if not names:
+        st.warning("Enter at least one region.")
+        return
+    if len(names) > MAX_COMPARE_REGIONS:
+        st.warning(f"Comparing the first {MAX_COMPARE_REGIONS} regions.")
+        names = names[:MAX_COMPARE_REGIONS]
+
+    progress = st.progress(0.0, text=f"Loading {len(names)} regions...")
+    table = st.empty()
+    rows = []
+    mixes = {}
+    failures = []
+    # Results arrive in completion order, so fast regions show up while large ones are still loading.
+    # Each region goes through the cached fetcher, so a repeated comparison costs no Overpass queries.
+    for done, (name, result, error) in enumerate(
+        load_regions(names, lambda name: fetch_region(name, include_legacy)), start=1
+    ):
+        if error is not None:
+            failures.append(f"{name}: {error}")
+        else:
+            frame, geo = result
+            residents = population(geo)
+            mix = category_mix(frame)
+            mixes[name] = mix
+            rows.append(
+                {
+                    "Region": name,
+                    "Merchants": len(frame),
+                    "Population": residents,
+                    "Per 1M residents": len(frame) / residents * 1_000_000 if residents else None,
+                    "Top categories": ", ".join(
+                        f"{category} {share:.0%}" for category, share in mix.items() if category != "(other)"
+                    ),
+                }
+            )
+            comparison = pd.DataFrame(rows).sort_values("Merchants", ascending=False)
+            table.dataframe(comparison, use_container_width=True, hide_index=True)
+        progress.progress(done / len(names), text=f"Loaded {done} of {len(names)} regions")
+
+    for failure in failures:
+        st.warning(f"Failed to load {failure}")
+    if not mixes:
+        return
+
+    st.caption("Population comes from the OSM population tag via Nominatim and may be missing or dated.")
+    mix_df = pd.DataFrame(mixes).T.fillna(0.0)
+    fig = go.Figure()
+    for category in mix_df.columns:
+        fig.add_trace(go.Bar(name=str(category), x=mix_df.index, y=mix_df[category]))
+    fig.update_layout(
+        barmode="stack",
+        yaxis=dict(tickformat=".0%", title="Share of merchants"),
+        margin=dict(l=10, r=10, t=20, b=10),
+    )
+    st.plotly_chart(fig, use_container_width=True)
+
+
 # ----------------------------
 # Daily brief
 # ----------------------------
@@ -739,32 +988,16 @@ def render_brief():
         with cols[idx]:
             try:
                 _, df = fetch_blockchain_chart(chart, "30days")
-                df = df.sort_values("date")
-                latest = df.iloc[-1, 1]
-                previous = df.iloc[-8, 1] if len(df) > 8 else df.iloc[0, 1]
-                delta = latest - previous
+                rollups = chart_rollups(chart, "30days", df)
                 st.metric(
                     label,
-                    format_compact(latest),
-                    delta=f"{format_compact(delta)} vs 7d",
+                    format_compact(rollups.latest),
+                    delta=f"{format_compact(rollups.delta_7d)} vs 7d",
                 )
             except Exception:
                 st.metric(label, "--")
 
     st.markdown("### News Brief (Daily)")
-    def parse_rss_fallback(url: str):
-        response = requests.get(url, timeout=20)
-        response.raise_for_status()
-        root = ET.fromstring(response.text)
-        items = root.findall(".//item")
-        results = []
-        for item in items[:10]:
-            title = item.findtext("title") or ""
-            link = item.findtext("link") or ""
-            published = item.findtext("pubDate") or item.findtext("published") or ""
-            results.append({"title": title, "link": link, "published": published})
-        return results
-
     sources = {
         "CoinDesk": "https://www.coindesk.com/arc/outboundfeeds/rss/",
     }
@@ -777,25 +1010,10 @@ def render_brief():
 
     headlines = []
     for name in selected:
-        if feedparser is not None:
-            feed = feedparser.parse(sources[name])
-            for entry in feed.entries[:10]:
-                headlines.append(
-                    {
-                        "source": name,
-                        "title": entry.get("title", ""),
-                        "link": entry.get("link", ""),
-                        "published": entry.get("published", ""),
-                    }
-                )
-        else:
-            try:
-                entries = parse_rss_fallback(sources[name])
-                for entry in entries:
-                    entry["source"] = name
-                    headlines.append(entry)
-            except Exception:
-                continue
+        try:
+            headlines.extend(fetch_headlines(name, sources[name]))
+        except Exception:
+            continue
 
     if not headlines:
         st.warning("No headlines available. The feed may be blocked or unavailable.")
@@ -818,6 +1036,37 @@ def render_brief():
         st.write("No dominant themes yet.")
 
 
+def parse_rss_fallback(url: str):
+    response = requests.get(url, timeout=20)
+    response.raise_for_status()
+    root = ET.fromstring(response.text)
+    items = root.findall(".//item")
+    results = []
+    for item in items[:10]:
+        title = item.findtext("title") or ""
+        link = item.findtext("link") or ""
+        published = item.findtext("pubDate") or item.findtext("published") or ""
+        results.append({"title": title, "link": link, "published": published})
+    return results
+
+
+@budget_cached(ttl=900, shared=True)
+def fetch_headlines(name: str, url: str):
+    if feedparser is not None:
+        entries = feedparser.parse(url).entries[:10]
+    else:
+        entries = parse_rss_fallback(url)
+    return [
+        {
+            "source": name,
+            "title": entry.get("title", ""),
+            "link": entry.get("link", ""),
+            "published": entry.get("published", ""),
+        }
+        for entry in entries
+    ]
+
+
 def extract_keywords(titles):
     stopwords = {
         "the",
@@ -0,0 +1,470 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+from utils import DATA_DIR
+
+OVERPASS_ENDPOINTS = [
+    "https://overpass-api.de/api/interpreter",
+    "https://overpass.kumi.systems/api/interpreter",
+    "https://overpass.private.coffee/api/interpreter",
+    "https://overpass.nchc.org.tw/api/interpreter",
+]
+
+# Public mirrors throttle per client, so cap how many queries each one has in flight.
+ENDPOINT_CONCURRENCY = 2
+# A mirror is skipped for BREAKER_COOLDOWN seconds after BREAKER_FAILURES consecutive failures.
+BREAKER_FAILURES = 3
+BREAKER_COOLDOWN = 120
+# When a mirror is slower than its own p95, a duplicate request goes to the next healthy mirror.
+HEDGE_REQUESTS = True
+HEDGE_MIN_SAMPLES = 10
+
+# A tile returning more elements than this is split for the next run; tiles smaller than
+# MIN_TILE_DEGREES on either side are never split further.
+ELEMENT_BUDGET = 5000
+MIN_TILE_DEGREES = 0.25
+LAYOUT_DB = os.path.join(DATA_DIR, "overpass_layouts.sqlite3")
+
+
+class OverpassTimeout(RuntimeError):
+    pass
+
+
+class _HedgeLost(Exception):
+    # Raised inside the slower of two hedged requests once the other has answered.
+    pass
+
+
+def osm_area_id(osm_type: str, osm_id: int):
+    if osm_type == "relation":
+        return 3600000000 + int(osm_id)
+    if osm_type == "way":
+        return 2400000000 + int(osm_id)
+    return None
+
+
+MERCHANT_TAGS = ["currency:XBT", "payment:onchain", "payment:lightning", "payment:lightning_contactless"]
+LEGACY_TAGS = ["payment:bitcoin"]
+# Only the tags the merchant table reads are requested; everything else stays on the server.
+ROW_TAGS = [
+    "name",
+    "addr:city",
+    "city",
+    "addr:state",
+    "addr:province",
+    "addr:country",
+    "amenity",
+    "shop",
+    "tourism",
+    "check_date",
+    "survey:date",
+    *MERCHANT_TAGS,
+]
+CSV_FIELDS = ["::type", "::id", "::lat", "::lon", "::timestamp", "::count"] + ROW_TAGS
+
+
+def _tag_filter(include_legacy: bool):
+    tags = MERCHANT_TAGS + (LEGACY_TAGS if include_legacy else [])
+    keys = "|".join(tags)
+    return f'[~"^({keys})$"~"^yes$"]'
+
+
+def legacy_only(tags):
+    # True when the element matched only through the legacy payment:bitcoin tag.
+    return not any(tags.get(tag) == "yes" for tag in MERCHANT_TAGS)
+
+
+def _merchant_query(scope_setup: str, scope: str, include_legacy: bool, since: str = None):
+    # One key-regex statement over nodes, ways and relations replaces a union of 12-15 exact-tag
+    # statements. CSV output drops the unused tags and the JSON framing; the trailing `out count`
+    # row marks a complete response.
+    # With `since` (an ISO timestamp) the query becomes an augmented diff: only merchants created,
+    # modified or dropped since then are returned, as XML because CSV cannot express deletions.
+    statement = f"{scope_setup}nwr{_tag_filter(include_legacy)}{scope};\n"
+    if since:
+        return f'[out:xml][timeout:50][adiff:"{since}"];\n{statement}out center meta;\n'
+    fields = ",".join(field if field.startswith("::") else f'"{field}"' for field in CSV_FIELDS)
+    return f'[out:csv({fields};true;"\\t")][timeout:50];\n{statement}out center meta;\nout count;\n'
+
+
+def overpass_query_area(area_id: int, include_legacy: bool, since: str = None):
+    return _merchant_query(f"area({area_id})->.searchArea;\n", "(area.searchArea)", include_legacy, since)
+
+
+def overpass_query_bbox(
+    south: float, west: float, north: float, east: float, include_legacy: bool, since: str = None
+):
+    return _merchant_query("", f"({south},{west},{north},{east})", include_legacy, since)
+
+
+def parse_csv_lines(lines, on_element):
+    # Consumes the response line by line; each element is handed to on_element as soon as it is read.
+    lines = iter(lines)
+    header = next(lines, "").split("\t")
+    count = 0
+    complete = False
+    for line in lines:
+        if not line:
+            continue
+        record = dict(zip(header, line.split("\t")))
+        osm_type = record.get("@type")
+        if osm_type == "count":
+            complete = True
+            continue
+        if not osm_type or not record.get("@lat") or not record.get("@lon"):
+            continue
+        on_element(
+            {
+                "type": osm_type,
+                "id": int(record["@id"]),
+                "lat": float(record["@lat"]),
+                "lon": float(record["@lon"]),
+                "timestamp": record.get("@timestamp") or None,
+                "tags": {tag: record[tag] for tag in ROW_TAGS if record.get(tag)},
+            }
+        )
+        count += 1
+    return count, complete
+
+
+def _xml_element(node):
+    el = {"type": node.tag, "id": int(node.get("id")), "timestamp": node.get("timestamp")}
+    if node.get("lat") is not None:
+        el["lat"] = float(node.get("lat"))
+        el["lon"] = float(node.get("lon"))
+    center = node.find("center")
+    if center is not None:
+        el["center"] = {"lat": float(center.get("lat")), "lon": float(center.get("lon"))}
+    el["tags"] = {tag.get("k"): tag.get("v") for tag in node.iter("tag")}
+    return el
+
+
+def parse_adiff(source, on_element):
+    # Streams an augmented diff. Each change reaches on_element as an element with an "action" of
+    # "create", "modify" or "delete"; merchants that lost their payment tags or left the scope count
+    # as deleted. Returns the number of changes and the server remark, if any.
+    count = 0
+    remark = None
+    for _, node in ET.iterparse(source, events=("end",)):
+        if node.tag == "remark":
+            remark = (node.text or "").strip()
+        if node.tag != "action":
+            continue
+        action = node.get("type")
+        holder = node.find("new")
+        if holder is None:
+            holder = node.find("old")
+        if holder is None:
+            holder = node
+        target = holder[0] if len(holder) else None
+        if target is not None:
+            el = _xml_element(target)
+            el["action"] = "delete" if action == "delete" or target.get("visible") == "false" else action
+            on_element(el)
+            count += 1
+        node.clear()
+    return count, remark
+
+
+class EndpointManager:
+    def __init__(self, endpoints, window: int = 50):
+        self.endpoints = list(endpoints)
+        self.lock = threading.Lock()
+        self.slots = {
+            endpoint: threading.BoundedSemaphore(ENDPOINT_CONCURRENCY) for endpoint in self.endpoints
+        }
+        self.latencies = {endpoint: deque(maxlen=window) for endpoint in self.endpoints}
+        self.outcomes = {endpoint: deque(maxlen=window) for endpoint in self.endpoints}
+        self.in_flight = {endpoint: 0 for endpoint in self.endpoints}
+        self.consecutive_failures = {endpoint: 0 for endpoint in self.endpoints}
+        self.opened_at = {endpoint: None for endpoint in self.endpoints}
+
+    def _is_open(self, endpoint: str, now: float):
+        opened = self.opened_at[endpoint]
+        # After the cooldown the breaker is half-open: the mirror is offered again, and one more
+        # failure re-opens it immediately.
+        return opened is not None and now - opened < BREAKER_COOLDOWN
+
+    def error_rate(self, endpoint: str):
+        outcomes = self.outcomes[endpoint]
+        return (outcomes.count(False) / len(outcomes)) if outcomes else 0.0
+
+    def latency_quantile(self, endpoint: str, q: float):
+        samples = sorted(self.latencies[endpoint])
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def ordered(self, start: int = 0):
+        now = time.monotonic()
+        with self.lock:
+            count = len(self.endpoints)
+            rotated = [self.endpoints[(start + i) % count] for i in range(count)]
+            closed = [endpoint for endpoint in rotated if not self._is_open(endpoint, now)]
+            # With every breaker open there is nothing to lose by trying them all anyway.
+            candidates = closed or rotated
+            return sorted(
+                candidates,
+                key=lambda endpoint: (
+                    round(self.error_rate(endpoint), 1),
+                    self.in_flight[endpoint] >= ENDPOINT_CONCURRENCY,
+                    self.latency_quantile(endpoint, 0.5) or 0.0,
+                ),
+            )
+
+    def hedge_delay(self, endpoint: str):
+        with self.lock:
+            if len(self.latencies[endpoint]) < HEDGE_MIN_SAMPLES:
+                return None
+            return self.latency_quantile(endpoint, 0.95)
+
+    def begin(self, endpoint: str):
+        with self.lock:
+            self.in_flight[endpoint] += 1
+
+    def abandon(self, endpoint: str):
+        # A request dropped by its caller says nothing about the mirror's health.
+        with self.lock:
+            self.in_flight[endpoint] -= 1
+
+    def record(self, endpoint: str, ok: bool, latency: float = None):
+        with self.lock:
+            self.in_flight[endpoint] -= 1
+            self.outcomes[endpoint].append(ok)
+            if ok:
+                self.consecutive_failures[endpoint] = 0
+                self.opened_at[endpoint] = None
+                if latency is not None:
+                    self.latencies[endpoint].append(latency)
+                return
+            self.consecutive_failures[endpoint] += 1
+            half_open = self.opened_at[endpoint] is not None
+            if half_open or self.consecutive_failures[endpoint] >= BREAKER_FAILURES:
+                self.opened_at[endpoint] = time.monotonic()
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self.lock:
+            return [
+                {
+                    "endpoint": endpoint,
+                    "p50_s": self.latency_quantile(endpoint, 0.5),
+                    "p95_s": self.latency_quantile(endpoint, 0.95),
+                    "error_rate": self.error_rate(endpoint),
+                    "circuit": "open" if self._is_open(endpoint, now) else "closed",
+                }
+                for endpoint in self.endpoints
+            ]
+
+
+endpoint_manager = EndpointManager(OVERPASS_ENDPOINTS)
+_hedge_pool = ThreadPoolExecutor(max_workers=len(OVERPASS_ENDPOINTS) * ENDPOINT_CONCURRENCY)
+
+
+def _post(endpoint: str, query: str, on_element, running=None, lost=None):
+    # For hedged requests, running is set once the request leaves the queues, and setting lost makes
+    # the request stop at its next element.
+    def emit(el):
+        if lost is not None and lost.is_set():
+            raise _HedgeLost()
+        on_element(el)
+
+    endpoint_manager.begin(endpoint)
+    with endpoint_manager.slots[endpoint]:
+        started = time.monotonic()
+        if running is not None:
+            running.set()
+        try:
+            if lost is not None and lost.is_set():
+                raise _HedgeLost()
+            with requests.post(
+                endpoint,
+                data=query.encode("utf-8"),
+                headers={"User-Agent": "BitcoinSignalHub/1.0"},
+                timeout=90,
+                stream=True,
+            ) as response:
+                response.raise_for_status()
+                if response.headers.get("Content-Type", "").startswith("text/csv"):
+                    response.encoding = response.encoding or "utf-8"
+                    lines = response.iter_lines(chunk_size=64 * 1024, decode_unicode=True)
+                    count, complete = parse_csv_lines(lines, emit)
+                    # Without the count row the server stopped early, most likely at the query timeout.
+                    remark = None if complete else "runtime error: CSV response ended before the count row"
+                elif "xml" in response.headers.get("Content-Type", ""):
+                    response.raw.decode_content = True
+                    count, remark = parse_adiff(response.raw, emit)
+                else:
+                    payload = response.json()
+                    elements = payload.get("elements", [])
+                    for element in elements:
+                        emit(element)
+                    count = len(elements)
+                    remark = payload.get("remark")
+        except _HedgeLost:
+            endpoint_manager.abandon(endpoint)
+            raise
+        except Exception:
+            endpoint_manager.record(endpoint, False)
+            raise
+
+    # Server-side timeouts come back as 200 with partial elements; another mirror would time out too.
+    # The mirror itself answered, so it counts as healthy, but the latency is not representative.
+    if "runtime error" in (remark or ""):
+        endpoint_manager.record(endpoint, True)
+        raise OverpassTimeout(remark)
+    endpoint_manager.record(endpoint, True, time.monotonic() - started)
+    return count
+
+
+def _hedged_post(primary: str, backup: str, query: str, on_element, delay: float):
+    # The hedge delay runs from when the primary request starts, not from when it was queued: time
+    # spent waiting for a pool worker or a mirror slot says nothing about the mirror being slow.
+    running = threading.Event()
+    lost = threading.Event()
+    futures = [_hedge_pool.submit(_post, primary, query, on_element, running, lost)]
+    futures[0].add_done_callback(lambda _: running.set())
+    running.wait()
+    done, _ = wait(futures, timeout=delay)
+    primary_failed = done and not isinstance(futures[0].exception(), (type(None), OverpassTimeout))
+    if not done or primary_failed:
+        futures.append(_hedge_pool.submit(_post, backup, query, on_element, None, lost))
+
+    last_error = None
+    pending = set(futures)
+    try:
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result()
+                except OverpassTimeout:
+                    raise
+                except Exception as exc:
+                    last_error = exc
+        raise last_error
+    finally:
+        # Stops the losing duplicate instead of letting it stream a second copy into on_element.
+        lost.set()
+
+
+def call_overpass(query: str, on_element, start: int = 0):
+    # Elements are streamed into on_element and the element count is returned. A failed or hedged
+    # attempt may deliver some elements twice, so on_element must tolerate duplicates.
+    # `start` rotates the order among equally healthy mirrors so concurrent tiles spread out.
+    endpoints = endpoint_manager.ordered(start)
+    last_error = None
+    index = 0
+    while index < len(endpoints):
+        primary = endpoints[index]
+        backup = endpoints[index + 1] if index + 1 < len(endpoints) else None
+        delay = endpoint_manager.hedge_delay(primary) if HEDGE_REQUESTS and backup else None
+        try:
+            if delay is None:
+                return _post(primary, query, on_element)
+            return _hedged_post(primary, backup, query, on_element, delay)
+        except OverpassTimeout:
+            raise
+        except Exception as exc:
+            last_error = exc
+        index += 1 if delay is None else 2
+    raise RuntimeError(f"Overpass query failed: {last_error}")
+
+
+def split_tile(tile):
+    south, west, north, east = tile
+    mid_lat = (south + north) / 2
+    mid_lon = (west + east) / 2
+    return [
+        (south, west, mid_lat, mid_lon),
+        (south, mid_lon, mid_lat, east),
+        (mid_lat, west, north, mid_lon),
+        (mid_lat, mid_lon, north, east),
+    ]
+
+
+def _can_split(tile):
+    south, west, north, east = tile
+    return min(abs(north - south), abs(east - west)) / 2 >= MIN_TILE_DEGREES
+
+
+def fetch_quadtree(bbox, build_query, on_element, layout=None, element_budget: int = ELEMENT_BUDGET):
+    # Tiles are queried concurrently. A tile that times out is split and re-queried now; a tile over
+    # the element budget is kept but split in the returned layout so the next run queries it finer.
+    workers = len(OVERPASS_ENDPOINTS) * ENDPOINT_CONCURRENCY
+    pool = ThreadPoolExecutor(max_workers=workers)
+    pending = {}
+    submitted = 0
+    leaves = []
+
+    def submit(tile):
+        nonlocal submitted
+        pending[pool.submit(call_overpass, build_query(tile), on_element, submitted)] = tile
+        submitted += 1
+
+    try:
+        for tile in layout or [tuple(bbox)]:
+            submit(tuple(tile))
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                tile = pending.pop(future)
+                try:
+                    tile_count = future.result()
+                except OverpassTimeout:
+                    if not _can_split(tile):
+                        raise
+                    for child in split_tile(tile):
+                        submit(child)
+                    continue
+
+                if tile_count > element_budget and _can_split(tile):
+                    leaves.extend(split_tile(tile))
+                else:
+                    leaves.append(tile)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    return leaves
+
+
+class TileLayoutStore:
+    def __init__(self, path: str = LAYOUT_DB):
+        self.path = path
+        self.lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS layouts (key TEXT PRIMARY KEY, tiles TEXT NOT NULL)"
+            )
+        return self._conn
+
+    def get(self, key: str):
+        with self.lock:
+            row = self._connect().execute(
+                "SELECT tiles FROM layouts WHERE key = ?", (key,)
+            ).fetchone()
+        return [tuple(tile) for tile in json.loads(row[0])] if row else None
+
+    def put(self, key: str, tiles):
+        with self.lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO layouts (key, tiles) VALUES (?, ?)",
+                (key, json.dumps([list(tile) for tile in tiles])),
+            )
+            conn.commit()
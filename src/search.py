@@ -0,0 +1,114 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+PAGE_SIZE = 50
+# Match quality per query term: whole word, word prefix, or a word within a few typos.
+EXACT, PREFIX, FUZZY = 3, 2, 1
+FUZZY_MIN_LENGTH = 3
+FUZZY_SIMILARITY = 0.5
+
+_TOKEN_PATTERN = r"[^\W_]+"
+
+
+def normalize_text(series):
+    # Lowercase and strip accents so "Café" and "cafe" index the same word.
+    return (
+        series.astype("string")
+        .fillna("")
+        .str.lower()
+        .str.normalize("NFKD")
+        .str.replace("[\u0300-\u036f]", "", regex=True)
+    )
+
+
+def _trigrams(word: str):
+    padded = f" {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class MerchantSearch:
+    # Inverted index from words in merchant names and categories to row positions. The vocabulary is
+    # sorted, so an exact word or a prefix is one contiguous run of postings found by binary search;
+    # fuzzy matches go through a trigram index over the (much smaller) vocabulary.
+    def __init__(self, texts):
+        tokens = normalize_text(pd.Series(texts)).str.findall(_TOKEN_PATTERN).explode().dropna()
+        rows = tokens.index.to_numpy(dtype=np.int64)
+        codes, vocabulary = pd.factorize(tokens.to_numpy(dtype=object), sort=True)
+
+        order = np.lexsort((rows, codes))
+        self.size = len(texts)
+        self.vocabulary = np.asarray(vocabulary, dtype=str)
+        self.postings = rows[order]
+        self.offsets = np.searchsorted(codes[order], np.arange(len(vocabulary) + 1))
+        self._grams = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_frame(cls, df, columns=("name", "category")):
+        texts = df[columns[0]].astype("string").fillna("")
+        for column in columns[1:]:
+            texts = texts + " " + df[column].astype("string").fillna("")
+        return cls(texts.reset_index(drop=True))
+
+    def _gram_index(self):
+        with self.lock:
+            if self._grams is None:
+                grams = {}
+                for word_id, word in enumerate(self.vocabulary):
+                    for gram in _trigrams(word):
+                        grams.setdefault(gram, []).append(word_id)
+                self._grams = {gram: np.array(ids, dtype=np.int64) for gram, ids in grams.items()}
+        return self._grams
+
+    def _fuzzy_words(self, term: str):
+        grams = _trigrams(term)
+        index = self._gram_index()
+        hits = [index[gram] for gram in grams if gram in index]
+        if not hits:
+            return np.empty(0, dtype=np.int64)
+        word_ids, shared = np.unique(np.concatenate(hits), return_counts=True)
+        lengths = np.char.str_len(self.vocabulary[word_ids])
+        # A padded word of length n has n trigrams, so this is shared / max(trigram counts).
+        similarity = shared / np.maximum(lengths, len(term))
+        close = (similarity >= FUZZY_SIMILARITY) & (np.abs(lengths - len(term)) <= 2)
+        return word_ids[close]
+
+    def _term_quality(self, term: str):
+        quality = np.zeros(self.size, dtype=np.int8)
+        lo = np.searchsorted(self.vocabulary, term, side="left")
+        hi = np.searchsorted(self.vocabulary, term + "\uffff", side="left")
+        if len(term) >= FUZZY_MIN_LENGTH:
+            for word_id in self._fuzzy_words(term):
+                quality[self.postings[self.offsets[word_id]:self.offsets[word_id + 1]]] = FUZZY
+        if hi > lo:
+            quality[self.postings[self.offsets[lo]:self.offsets[hi]]] = PREFIX
+            if self.vocabulary[lo] == term:
+                quality[self.postings[self.offsets[lo]:self.offsets[lo + 1]]] = EXACT
+        return quality
+
+    def search(self, query: str, mask=None):
+        # Row positions matching every query word, best matches first, then in row order.
+        terms = normalize_text(pd.Series([query])).str.findall(_TOKEN_PATTERN).iloc[0]
+        if not terms:
+            return np.flatnonzero(mask) if mask is not None else np.arange(self.size)
+
+        score = np.zeros(self.size, dtype=np.int16)
+        matched = np.ones(self.size, dtype=bool) if mask is None else np.asarray(mask, dtype=bool).copy()
+        for term in dict.fromkeys(terms):
+            quality = self._term_quality(term)
+            matched &= quality > 0
+            score += quality
+
+        rows = np.flatnonzero(matched)
+        return rows[np.argsort(-score[rows], kind="stable")]
+
+
+def page_count(total: int, page_size: int = PAGE_SIZE):
+    return max(1, -(-total // page_size))
+
+
+def page(rows, number: int, page_size: int = PAGE_SIZE):
+    start = (number - 1) * page_size
+    return rows[start:start + page_size]
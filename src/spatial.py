@@ -0,0 +1,218 @@
+import functools
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils import DATA_DIR
+
+
+def group_centroids(df, key: str):
+    # Per group, the merchant closest to the mean position. Unlike the raw mean this always lands on a
+    # real location, so coastal or crescent-shaped regions do not get bubbles in the sea.
+    points = df[[key, "lat", "lon"]].dropna()
+    if points.empty:
+        return pd.DataFrame(columns=[key, "lat", "lon"])
+
+    grouped = points.groupby(key, observed=True)
+    mean_lat = grouped["lat"].transform("mean")
+    mean_lon = grouped["lon"].transform("mean")
+    dist = (points["lat"] - mean_lat) ** 2 + ((points["lon"] - mean_lon) * np.cos(np.radians(mean_lat))) ** 2
+
+    nearest = dist.groupby(points[key], observed=True).idxmin()
+    return points.loc[nearest.to_numpy()].reset_index(drop=True)
+
+
+def grid_labels(lat, lon, max_cells: int):
+    # Bins points into square cells, coarsening until at most max_cells are non-empty. Returns each
+    # point's cell label, the points per cell and the cell size in degrees.
+    lat = np.asarray(lat, dtype="float64")
+    lon = np.asarray(lon, dtype="float64")
+    lat_min, lon_min = lat.min(), lon.min()
+    span = max(np.ptp(lat), np.ptp(lon), 1e-3)
+    size = span / max_cells
+    while True:
+        cols = int(span / size) + 1
+        rows = np.floor((lat - lat_min) / size).astype(np.int64)
+        keys = rows * cols + np.floor((lon - lon_min) / size).astype(np.int64)
+        cells, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        if len(cells) <= max_cells:
+            return inverse, counts, size
+        size *= 1.4
+
+
+def timelapse_cells(lat, lon, dates, max_cells: int, freq: str = "M"):
+    # Long table of (period, lat, lon, count) with the cumulative merchants per grid cell at the end of
+    # each period: one map frame per period. Cells keep one position across frames so markers grow in
+    # place. Undated points are skipped.
+    dates = pd.Series(pd.to_datetime(dates)).reset_index(drop=True)
+    dated = dates.notna().to_numpy()
+    lat = np.asarray(lat, dtype="float64")[dated]
+    lon = np.asarray(lon, dtype="float64")[dated]
+    if len(lat) == 0:
+        return pd.DataFrame(columns=["period", "lat", "lon", "count"])
+
+    inverse, counts, _ = grid_labels(lat, lon, max_cells)
+    periods = pd.PeriodIndex(dates[dated], freq=freq)
+    full = pd.period_range(periods.min(), periods.max(), freq=freq)
+    grid = np.zeros((len(full), len(counts)), dtype=np.int64)
+    np.add.at(grid, (periods.asi8 - full.asi8[0], inverse), 1)
+    cumulative = np.cumsum(grid, axis=0)
+
+    frame_ids, cell_ids = np.nonzero(cumulative)
+    return pd.DataFrame(
+        {
+            "period": full.astype(str)[frame_ids],
+            "lat": (np.bincount(inverse, weights=lat) / counts)[cell_ids],
+            "lon": (np.bincount(inverse, weights=lon) / counts)[cell_ids],
+            "count": cumulative[frame_ids, cell_ids],
+        }
+    )
+
+
+def zoom_for_span(span_degrees: float):
+    return float(np.clip(np.log2(360 / max(span_degrees, 1e-3)), 1, 15))
+
+
+# Offline admin boundaries (e.g. Natural Earth admin-1 states/provinces, or an OSM admin_level=8
+# export for cities) as GeoJSON polygons. Region assignment is skipped when a file is absent.
+ADMIN_LAYERS = {
+    "state": (os.path.join(DATA_DIR, "admin_states.geojson"), "name"),
+    "city": (os.path.join(DATA_DIR, "admin_cities.geojson"), "name"),
+}
+# Caps the points x edges matrix of one ray-casting step.
+_PIP_CHUNK = 2_000_000
+
+
+def geometry_polygons(geometry):
+    # The polygons of a GeoJSON Polygon or MultiPolygon geometry, each a list of rings; other
+    # geometry types have none.
+    geometry = geometry or {}
+    if geometry.get("type") == "Polygon":
+        return [geometry["coordinates"]]
+    if geometry.get("type") == "MultiPolygon":
+        return list(geometry["coordinates"])
+    return []
+
+
+class AdminIndex:
+    def __init__(self, polygons):
+        # polygons: list of (name, [ring, ...]) with rings as (n, 2) lon/lat arrays; holes are just extra
+        # rings because the even-odd crossing rule handles them.
+        self.names = []
+        self.edges = []
+        boxes = []
+        for name, rings in polygons:
+            coords = [np.asarray(ring, dtype="float64") for ring in rings if len(ring) >= 3]
+            if not coords:
+                continue
+            starts = np.concatenate([ring for ring in coords])
+            ends = np.concatenate([np.roll(ring, -1, axis=0) for ring in coords])
+            self.names.append(name)
+            self.edges.append((starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1]))
+            boxes.append((starts[:, 0].min(), starts[:, 1].min(), starts[:, 0].max(), starts[:, 1].max()))
+        self.boxes = np.array(boxes, dtype="float64").reshape(-1, 4)
+        self._band_cache = {}
+
+    @classmethod
+    def from_geojson(cls, path: str, name_property: str = "name"):
+        with open(path, encoding="utf-8") as handle:
+            features = json.load(handle).get("features", [])
+        polygons = []
+        for feature in features:
+            name = (feature.get("properties") or {}).get(name_property)
+            if name:
+                polygons.extend((name, rings) for rings in geometry_polygons(feature.get("geometry")))
+        return cls(polygons)
+
+    def assign(self, lat, lon):
+        lat = np.asarray(lat, dtype="float64")
+        lon = np.asarray(lon, dtype="float64")
+        result = np.full(len(lat), None, dtype=object)
+        unassigned = np.ones(len(lat), dtype=bool)
+
+        # Points sorted by longitude let each polygon slice its bbox strip with a binary search.
+        order = np.argsort(lon, kind="stable")
+        sorted_lon = lon[order]
+        for index, (west, south, east, north) in enumerate(self.boxes):
+            lo = np.searchsorted(sorted_lon, west, side="left")
+            hi = np.searchsorted(sorted_lon, east, side="right")
+            strip = order[lo:hi]
+            candidates = strip[unassigned[strip] & (lat[strip] >= south) & (lat[strip] <= north)]
+            if len(candidates) == 0:
+                continue
+            inside = self._contains(index, lon[candidates], lat[candidates])
+            hits = candidates[inside]
+            result[hits] = self.names[index]
+            unassigned[hits] = False
+        return result
+
+    def _bands(self, index):
+        # Edges bucketed into horizontal bands: a ray from a point can only cross edges whose
+        # latitude range covers the point, so each point is tested against its band only.
+        cached = self._band_cache.get(index)
+        if cached is not None:
+            return cached
+        x1, y1, x2, y2 = self.edges[index]
+        south, north = self.boxes[index][1], self.boxes[index][3]
+        count = int(np.clip(len(x1) // 16, 1, 256))
+        height = (north - south) / count or 1.0
+        lo = np.clip(((np.minimum(y1, y2) - south) / height).astype(np.int64), 0, count - 1)
+        hi = np.clip(((np.maximum(y1, y2) - south) / height).astype(np.int64), 0, count - 1)
+        spans = hi - lo + 1
+        edge_ids = np.repeat(np.arange(len(x1)), spans)
+        band_ids = np.repeat(lo, spans) + (np.arange(spans.sum()) - np.repeat(np.cumsum(spans) - spans, spans))
+        order = np.argsort(band_ids, kind="stable")
+        edge_ids = edge_ids[order]
+        offsets = np.searchsorted(band_ids[order], np.arange(count + 1))
+        cached = self._band_cache[index] = (south, height, count, edge_ids, offsets)
+        return cached
+
+    def _contains(self, index, px, py):
+        x1, y1, x2, y2 = self.edges[index]
+        south, height, count, edge_ids, offsets = self._bands(index)
+        inside = np.zeros(len(px), dtype=bool)
+
+        point_bands = np.clip(((py - south) / height).astype(np.int64), 0, count - 1)
+        order = np.argsort(point_bands, kind="stable")
+        bounds = np.searchsorted(point_bands[order], np.arange(count + 1))
+        for band in np.flatnonzero(np.diff(bounds)):
+            points = order[bounds[band]:bounds[band + 1]]
+            edges = edge_ids[offsets[band]:offsets[band + 1]]
+            if len(edges) == 0:
+                continue
+            ex1, ey1, ex2, ey2 = x1[edges], y1[edges], x2[edges], y2[edges]
+            step = max(1, _PIP_CHUNK // len(edges))
+            for start in range(0, len(points), step):
+                chunk = points[start:start + step]
+                cx = px[chunk, None]
+                cy = py[chunk, None]
+                straddles = (ey1 > cy) != (ey2 > cy)
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    crossing_x = (ex2 - ex1) * (cy - ey1) / (ey2 - ey1) + ex1
+                crossings = np.count_nonzero(straddles & (cx < crossing_x), axis=1)
+                inside[chunk] = crossings % 2 == 1
+        return inside
+
+
+@functools.lru_cache(maxsize=None)
+def admin_index(level: str):
+    path, name_property = ADMIN_LAYERS[level]
+    if not os.path.exists(path):
+        return None
+    return AdminIndex.from_geojson(path, name_property)
+
+
+def assign_admin_regions(df):
+    # Polygon names take precedence so tagged and untagged merchants share one spelling per region;
+    # addr:* tags remain the fallback outside the loaded boundaries.
+    for column in ("state", "city"):
+        index = admin_index(column)
+        if index is None or df.empty:
+            continue
+        assigned = index.assign(df["lat"].to_numpy(), df["lon"].to_numpy())
+        tagged = df[column].astype(object).to_numpy()
+        values = np.where(pd.notna(assigned), assigned, tagged)
+        df[column] = pd.Categorical(values)
+    return df
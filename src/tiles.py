@@ -0,0 +1,249 @@
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+except Exception:  # pragma: no cover - optional dependency for local envs
+    pyarrow = None
+
+from utils import DATA_DIR
+
+EXPORT_DIR = os.path.join(DATA_DIR, "exports")
+# Datasets loaded in the app are exported here in the background, keeping only the EXPORT_KEEP most
+# recently written; the store-wide export from scripts/export_merchants.py lives beside it, untouched.
+DATASET_EXPORT_DIR = os.path.join(EXPORT_DIR, "datasets")
+EXPORT_KEEP = 12
+# Staging folders older than this were left behind by a process that died mid-export.
+STALE_STAGING_AGE = 24 * 3600
+# Each tile is a CELLS_PER_TILE x CELLS_PER_TILE grid of merchant counts in Web Mercator, so a tile
+# never holds more than 1,024 cells however dense the area. At MAX_ZOOM a cell is about 300 m across.
+MIN_ZOOM = 0
+MAX_ZOOM = 12
+CELLS_PER_TILE = 32
+# A viewport spanning more tiles than this at some zoom is drawn from a coarser zoom instead.
+MAX_VIEW_TILES = 64
+_MAX_LATITUDE = 85.05112878
+
+MBTILES_SCHEMA = """
+CREATE TABLE metadata (name TEXT, value TEXT);
+CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB);
+CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row);
+"""
+
+
+def export_slug(name: str):
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-") or "merchants"
+
+
+def mercator(lat, lon):
+    # Fractional Web Mercator coordinates in [0, 1), with y growing southwards like XYZ tile rows.
+    lat = np.radians(np.clip(np.asarray(lat, dtype="float64"), -_MAX_LATITUDE, _MAX_LATITUDE))
+    x = (np.asarray(lon, dtype="float64") + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0
+    top = np.nextafter(1.0, 0.0)
+    return np.clip(x, 0.0, top), np.clip(y, 0.0, top)
+
+
+def _zoom_cells(mx, my, lat, lon, zoom: int):
+    # Non-empty cells of one zoom level as (keys, mean lat, mean lon, count). Keys sort tile first, so
+    # each tile's cells form one contiguous run.
+    per_tile = CELLS_PER_TILE * CELLS_PER_TILE
+    side = (1 << zoom) * CELLS_PER_TILE
+    gx = (mx * side).astype(np.int64)
+    gy = (my * side).astype(np.int64)
+    tile_key = (gy // CELLS_PER_TILE) * (1 << zoom) + gx // CELLS_PER_TILE
+    keys = tile_key * per_tile + (gy % CELLS_PER_TILE) * CELLS_PER_TILE + gx % CELLS_PER_TILE
+    cells, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    return cells, np.bincount(inverse, weights=lat) / counts, np.bincount(inverse, weights=lon) / counts, counts
+
+
+def build_tiles(lat, lon, min_zoom: int = MIN_ZOOM, max_zoom: int = MAX_ZOOM):
+    # Yields (zoom, x, y, cells) in XYZ numbering, with cells as (n, 3) arrays of mean lat, mean lon
+    # and merchant count.
+    lat = np.asarray(lat, dtype="float64")
+    lon = np.asarray(lon, dtype="float64")
+    if len(lat) == 0:
+        return
+    mx, my = mercator(lat, lon)
+    per_tile = CELLS_PER_TILE * CELLS_PER_TILE
+    for zoom in range(min_zoom, max_zoom + 1):
+        cells, cell_lat, cell_lon, counts = _zoom_cells(mx, my, lat, lon, zoom)
+        tiles, starts = np.unique(cells // per_tile, return_index=True)
+        ends = np.append(starts[1:], len(cells))
+        for tile, start, end in zip(tiles, starts, ends):
+            rows = np.column_stack([cell_lat[start:end], cell_lon[start:end], counts[start:end]])
+            yield zoom, int(tile % (1 << zoom)), int(tile // (1 << zoom)), rows
+
+
+def _write_geojson(df, path: str):
+    properties = df.drop(columns=["lat", "lon"])
+    for column in properties.select_dtypes("datetime").columns:
+        properties[column] = properties[column].dt.strftime("%Y-%m-%d")
+    properties = properties.astype(object)
+    records = properties.where(properties.notna(), None).to_dict("records")
+    lon = np.round(df["lon"].to_numpy(dtype="float64"), 6).tolist()
+    lat = np.round(df["lat"].to_numpy(dtype="float64"), 6).tolist()
+    with open(path, "w", encoding="utf-8") as handle:
+        handle.write('{"type": "FeatureCollection", "features": [\n')
+        for index, (record, x, y) in enumerate(zip(records, lon, lat)):
+            feature = {"type": "Feature", "geometry": {"type": "Point", "coordinates": [x, y]}, "properties": record}
+            handle.write(("," if index else "") + json.dumps(feature, ensure_ascii=False) + "\n")
+        handle.write("]}\n")
+
+
+def _write_mbtiles(df, path: str, name: str):
+    # MBTiles layout (one SQLite file, TMS row order) so tile servers and GIS tools can open it; the
+    # tile payload is a JSON list of [lat, lon, count] cells rather than a Mapbox vector tile.
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(MBTILES_SCHEMA)
+        conn.executemany(
+            "INSERT INTO tiles VALUES (?, ?, ?, ?)",
+            (
+                (zoom, x, (1 << zoom) - 1 - y, json.dumps(np.round(cells, 6).tolist()).encode("utf-8"))
+                for zoom, x, y, cells in build_tiles(df["lat"], df["lon"])
+            ),
+        )
+        bounds = [df["lon"].min(), df["lat"].min(), df["lon"].max(), df["lat"].max()] if len(df) else [0, 0, 0, 0]
+        metadata = {
+            "name": name,
+            "format": "json",
+            "type": "overlay",
+            "minzoom": MIN_ZOOM,
+            "maxzoom": MAX_ZOOM,
+            "bounds": ",".join(f"{float(value):.6f}" for value in bounds),
+            "json": json.dumps({"cells_per_tile": CELLS_PER_TILE, "merchants": len(df), "created_at": time.time()}),
+        }
+        conn.executemany("INSERT INTO metadata VALUES (?, ?)", [(key, str(value)) for key, value in metadata.items()])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def export_merchants(df, name: str, directory: str = EXPORT_DIR):
+    # Writes <directory>/<slug>/ with merchants.parquet (when pyarrow is installed), merchants.geojson
+    # and merchants.mbtiles, and returns its path. The export is assembled in a staging folder unique
+    # to this call and swapped in at the end, so readers never see a half-written directory.
+    target = os.path.join(directory, export_slug(name))
+    token = uuid.uuid4().hex
+    staging = f"{target}.tmp-{token}"
+    os.makedirs(staging)
+
+    try:
+        if pyarrow is not None:
+            df.to_parquet(os.path.join(staging, "merchants.parquet"), index=False)
+        _write_geojson(df, os.path.join(staging, "merchants.geojson"))
+        _write_mbtiles(df, os.path.join(staging, "merchants.mbtiles"), name)
+
+        previous = f"{target}.old-{token}"
+        try:
+            os.replace(target, previous)
+        except FileNotFoundError:
+            pass
+        try:
+            os.replace(staging, target)
+        except OSError:
+            # Another export of the same name was swapped in first; it is just as fresh as this one.
+            pass
+        shutil.rmtree(previous, ignore_errors=True)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return target
+
+
+def prune_exports(directory: str, keep: int = EXPORT_KEEP):
+    # Keeps the keep most recently written exports in directory and drops abandoned staging folders.
+    if not os.path.isdir(directory):
+        return
+    now = time.time()
+    finished = []
+    for entry in os.scandir(directory):
+        if not entry.is_dir():
+            continue
+        modified = entry.stat().st_mtime
+        if ".tmp-" in entry.name or ".old-" in entry.name:
+            if now - modified > STALE_STAGING_AGE:
+                shutil.rmtree(entry.path, ignore_errors=True)
+            continue
+        finished.append((modified, entry.path))
+    for _, path in sorted(finished, reverse=True)[keep:]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+_exporter = ThreadPoolExecutor(max_workers=1)
+_queued = set()
+_queued_lock = threading.Lock()
+
+
+def export_in_background(df, name: str, directory: str = DATASET_EXPORT_DIR):
+    # Queues export_merchants off the request path, one export at a time; a name already queued is not
+    # queued again. Failures only cost the export, never the page.
+    slug = export_slug(name)
+    with _queued_lock:
+        if slug in _queued:
+            return None
+        _queued.add(slug)
+
+    def run():
+        try:
+            export_merchants(df, name, directory)
+            prune_exports(directory)
+        finally:
+            with _queued_lock:
+                _queued.discard(slug)
+
+    return _exporter.submit(run)
+
+
+def _view_tiles(zoom: int, south: float, west: float, north: float, east: float):
+    # How many tiles of this zoom level the viewport covers.
+    (x0, x1), (y1, y0) = mercator([south, north], [west, east])
+    count = 1 << zoom
+    return (int(x1 * count) - int(x0 * count) + 1) * (int(y1 * count) - int(y0 * count) + 1)
+
+
+class FrameTiles:
+    # The zoom-levelled cells of an MBTiles export, computed in memory from the coordinates one zoom
+    # level at a time as views ask for them, so the map never waits for (or reads a stale) export.
+    def __init__(self, lat, lon):
+        self.lat = np.asarray(lat, dtype="float64")
+        self.lon = np.asarray(lon, dtype="float64")
+        self.mx, self.my = mercator(self.lat, self.lon)
+        self.levels = {}
+        self.lock = threading.Lock()
+
+    def _level(self, zoom: int):
+        with self.lock:
+            level = self.levels.get(zoom)
+            if level is None:
+                _, cell_lat, cell_lon, counts = _zoom_cells(self.mx, self.my, self.lat, self.lon, zoom)
+                level = self.levels[zoom] = np.column_stack([cell_lat, cell_lon, counts])
+        return level
+
+    def _cells(self, zoom: int, south: float, west: float, north: float, east: float):
+        cells = self._level(zoom)
+        inside = (cells[:, 0] >= south) & (cells[:, 0] <= north) & (cells[:, 1] >= west) & (cells[:, 1] <= east)
+        return cells[inside]
+
+    def view(self, south: float, west: float, north: float, east: float, max_cells: int):
+        # Cells inside the viewport at the most detailed zoom that keeps them within max_cells and the
+        # viewport within MAX_VIEW_TILES tiles. Returns the cells and the zoom they came from.
+        zoom, cells = MIN_ZOOM, self._cells(MIN_ZOOM, south, west, north, east)
+        for candidate in range(MIN_ZOOM + 1, MAX_ZOOM + 1):
+            if _view_tiles(candidate, south, west, north, east) > MAX_VIEW_TILES:
+                break
+            candidate_cells = self._cells(candidate, south, west, north, east)
+            if len(candidate_cells) > max_cells:
+                break
+            zoom, cells = candidate, candidate_cells
+        return pd.DataFrame(cells, columns=["lat", "lon", "count"]), zoom
@@ -1,3 +1,12 @@
+import os
+
+# Local persistent caches (geocodes, merchant data) live here; override per deployment.
+DATA_DIR = os.environ.get(
+    "SIGNAL_HUB_DATA_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data"),
+)
+
+
 def format_compact(value):
     try:
         num = float(value)